@@ -1,14 +1,32 @@
 # app.py
-from flask import Flask, render_template, request, redirect, flash
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image as ExcelImage
+from flask import (
+    Flask, render_template, request, redirect, flash, jsonify, abort, url_for, send_file, g, Response, make_response,
+)
 import io
-import threading
 import base64
-import tempfile
+import re
+import atexit
+import time
+import threading
+import uuid
 import os
 import logging
-import requests
+from functools import wraps
+
+from excel_altas import (
+    EXCEL_MOTOR, FIRMA_ANCHO, FIRMA_ALTO, cache_plantillas, cache_plantillas_xml, precargar,
+    crear_excel_en_memoria, crear_excel_plantas_en_memoria,
+)
+from mapeo_celdas import MAX_PLANTAS, hay_alguna_planta, validar_alta
+from outbox import Outbox, FALLIDO
+from webhook import ClienteWebhook, CuerpoJson, Adjunto
+from metricas import (
+    Histograma, Perfilador, duracion_etapas, tamano_excel, medir_etapa, exportar_histograma, exportar_valores,
+)
+from firma import procesar_firma, FirmaInvalida
+from borradores import AlmacenBorradores, BorradorDemasiadoGrande
+from archivo import ArchivoAltas, ERROR as ERROR_ARCHIVO
+from correo import construir_body_html, construir_body_texto, construir_body_html_lote, construir_body_texto_lote
 
 # (Opcional en local) .env
 try:
@@ -18,7 +36,7 @@ except Exception:
     pass
 
 app = Flask(__name__)
-app.secret_key = 'supersecretkey'
+app.secret_key = os.getenv("SECRET_KEY", 'supersecretkey')  # firma también los tokens de borrador
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
@@ -26,49 +44,214 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(me
 GAS_WEBHOOK_URL = os.getenv("GAS_WEBHOOK_URL")    # URL de Apps Script (termina en /exec)
 MAIL_TO_ADMIN   = os.getenv("MAIL_TO_ADMIN")      # opcional
 FORCE_SYNC_SEND = os.getenv("FORCE_SYNC_SEND", "false").lower() in ("1", "true", "yes")
+ADMIN_TOKEN     = os.getenv("ADMIN_TOKEN")        # obligatorio para /admin/* y /metrics
+
+FIRMA_MAX_DATA_URL = int(os.getenv("FIRMA_MAX_DATA_URL", "2000000"))  # tamaño máx. del data URL recibido
+FIRMA_MAX_BYTES    = int(os.getenv("FIRMA_MAX_BYTES", "30000"))       # tamaño máx. del PNG incrustado
+
+# Cola de salida persistente para los envíos asíncronos
+OUTBOX_DB            = os.getenv("OUTBOX_DB", "outbox.sqlite3")
+OUTBOX_WORKERS       = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_MAX_INTENTOS  = int(os.getenv("OUTBOX_MAX_INTENTOS", "8"))
+OUTBOX_BACKOFF_BASE  = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))     # segundos
+OUTBOX_BACKOFF_MAX   = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))    # segundos
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "25"))   # segundos al apagar
+OUTBOX_RETENCION     = float(os.getenv("OUTBOX_RETENCION", "604800"))  # segundos que se guardan los terminados
+
+# Modo lote: agrupa varias altas en un solo correo (ahorra cuota de Apps Script)
+ENVIO_LOTES  = os.getenv("ENVIO_LOTES", "false").lower() in ("1", "true", "yes")
+LOTE_MAX     = int(os.getenv("LOTE_MAX", "20"))          # altas por correo
+LOTE_VENTANA = float(os.getenv("LOTE_VENTANA", "300"))   # segundos máx. de espera del alta más antigua
+
+# Conexión al webhook: pool keep-alive + circuit breaker
+WEBHOOK_POOL              = int(os.getenv("WEBHOOK_POOL", "10"))
+WEBHOOK_TIMEOUT_CONEXION  = float(os.getenv("WEBHOOK_TIMEOUT_CONEXION", "5"))
+WEBHOOK_TIMEOUT_LECTURA   = float(os.getenv("WEBHOOK_TIMEOUT_LECTURA", "30"))
+WEBHOOK_CIRCUITO_UMBRAL   = int(os.getenv("WEBHOOK_CIRCUITO_UMBRAL", "5"))      # fallos seguidos para abrir
+WEBHOOK_CIRCUITO_ESPERA   = float(os.getenv("WEBHOOK_CIRCUITO_ESPERA", "60"))   # segundos abierto
+# Campo(s) del JSON en que el Apps Script espera el base64 de cada adjunto ("content", "base64" o ambos)
+WEBHOOK_CAMPO_ADJUNTO     = tuple(c.strip() for c in os.getenv("WEBHOOK_CAMPO_ADJUNTO", "content").split(",") if c.strip())
+WEBHOOK_GZIP              = os.getenv("WEBHOOK_GZIP", "false").lower() in ("1", "true", "yes")
+
+# Borradores del alta en el servidor: /plantas guarda los datos del cliente y
+# /guardar recibe solo las plantas. false -> datos del cliente en campos ocultos
+BORRADORES          = os.getenv("BORRADORES", "true").lower() in ("1", "true", "yes")
+BORRADORES_DB       = os.getenv("BORRADORES_DB", "borradores.sqlite3")
+BORRADOR_TTL        = int(os.getenv("BORRADOR_TTL", "7200"))          # segundos
+BORRADOR_MAX_BYTES  = int(os.getenv("BORRADOR_MAX_BYTES", "262144"))
+BORRADORES_MAX      = int(os.getenv("BORRADORES_MAX", "10000"))
+COOKIE_BORRADOR     = "borrador_alta"
+RE_ID_ENVIO         = re.compile(r"[0-9a-f]{32}")
+RE_IDEMPOTENCY_KEY  = re.compile(r"[A-Za-z0-9_-]{1,64}")  # viaja en la URL de estado y en el archivo
+
+# Archivo de las altas (Excel + índice SQLite) para búsquedas y reenvíos
+ARCHIVO     = os.getenv("ARCHIVO", "true").lower() in ("1", "true", "yes")
+ARCHIVO_DIR = os.getenv("ARCHIVO_DIR", "formularios_guardados")
+
+# Perfilado opcional: fracción de peticiones perfiladas con cProfile (0 = desactivado)
+PERFILADO_TASA = float(os.getenv("PERFILADO_TASA", "0"))
+PERFILADO_DIR  = os.getenv("PERFILADO_DIR", "perfiles")
+
+cliente_webhook = ClienteWebhook(
+    GAS_WEBHOOK_URL,
+    pool=WEBHOOK_POOL,
+    timeout_conexion=WEBHOOK_TIMEOUT_CONEXION,
+    timeout_lectura=WEBHOOK_TIMEOUT_LECTURA,
+    umbral_fallos=WEBHOOK_CIRCUITO_UMBRAL,
+    tiempo_apertura=WEBHOOK_CIRCUITO_ESPERA,
+)
+
+# Plantillas parseadas una vez por worker (ver excel_altas.py)
+precargar()
+
+borradores = AlmacenBorradores(
+    BORRADORES_DB, app.secret_key,
+    ttl=BORRADOR_TTL, max_bytes=BORRADOR_MAX_BYTES, max_borradores=BORRADORES_MAX,
+) if BORRADORES else None
+archivo = ArchivoAltas(ARCHIVO_DIR) if ARCHIVO else None
+
+def requiere_admin(f):
+    # X-Admin-Token o "Authorization: Bearer <token>" (el que admite Prometheus).
+    # Sin ADMIN_TOKEN las rutas de administración quedan cerradas: exponen datos
+    # de clientes (IBAN en los Excel archivados) y permiten reenviar e importar.
+    @wraps(f)
+    def envoltura(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            abort(404)
+        token = request.headers.get("X-Admin-Token")
+        if token is None and request.authorization and request.authorization.type == "bearer":
+            token = request.authorization.token
+        if token != ADMIN_TOKEN:
+            abort(403)
+        return f(*args, **kwargs)
+    return envoltura
+
+# ===== Instrumentación =====
+duracion_peticiones = Histograma()
+perfilador = Perfilador(PERFILADO_TASA, PERFILADO_DIR)
+
+@app.before_request
+def _inicio_peticion():
+    g.inicio = time.perf_counter()
+    g.perfil = perfilador.iniciar() if request.endpoint != "metricas" else None
+
+@app.teardown_request
+def _fin_peticion(error=None):
+    if getattr(g, "perfil", None) is not None:
+        perfilador.terminar(g.perfil, request.endpoint or "sin_ruta")
+    if hasattr(g, "inicio"):
+        duracion_peticiones.observar(time.perf_counter() - g.inicio, request.endpoint or "sin_ruta")
 
 # ===== Rutas =====
 @app.route('/', methods=['GET'])
 def formulario():
-    return render_template('formulario.html')
+    return render_template('formulario.html', datos={})
+
+def _volver_al_formulario(datos_cliente, mensaje):
+    # Se vuelve a mostrar el paso 1 con lo ya escrito: solo hay que repetir la firma
+    flash(mensaje)
+    datos = {k: v for k, v in datos_cliente.items() if k != "firma_cliente"}
+    return render_template('formulario.html', datos=datos)
+
+def _pagina_plantas(token=None, datos=None):
+    # Con borrador solo viaja el token; sin él, los datos del cliente van en campos ocultos
+    datos = datos or {}
+    datos_cliente = {} if token else {k: v for k, v in datos.items() if not k.startswith("planta_")}
+    # id_envio identifica este rellenado de la página: un doble clic o una recarga del
+    # POST reenvían el mismo id y la cola los descarta; un alta nueva lleva otro id
+    return render_template('plantas.html', token_borrador=token, datos_cliente=datos_cliente,
+                           plantas_guardadas=datos, max_plantas=MAX_PLANTAS, id_envio=uuid.uuid4().hex)
+
+def _volver_a_plantas(token, data, plantas_data):
+    # Se guardan las plantas ya escritas para no perderlas al volver a la página
+    if token:
+        try:
+            borradores.guardar(token, plantas_data)
+        except BorradorDemasiadoGrande:
+            pass
+    return _pagina_plantas(token, data)
+
+def _firma_normalizada(data_url):
+    # El borrador guarda la firma ya reducida (200x60) en lugar del canvas original
+    png = procesar_firma(data_url, FIRMA_ANCHO, FIRMA_ALTO,
+                         max_data_url=FIRMA_MAX_DATA_URL, max_bytes=FIRMA_MAX_BYTES)
+    return "data:image/png;base64," + base64.b64encode(png).decode("ascii") if png else data_url
 
 @app.route('/plantas', methods=['POST', 'GET'])
 def plantas():
     if request.method == 'GET':
-        flash('Por favor, rellena primero el formulario de cliente.')
-        return redirect('/')
+        # Reanudar el borrador (recarga, caída de la red) desde la cookie
+        token = request.cookies.get(COOKIE_BORRADOR)
+        borrador = borradores.obtener(token) if borradores and token else None
+        if borrador is None:
+            flash('Por favor, rellena primero el formulario de cliente.')
+            return redirect('/')
+        return _pagina_plantas(token, borrador)
+
     datos_cliente = request.form.to_dict()
-    return render_template('plantas.html', datos_cliente=datos_cliente)
+    if not borradores:
+        return _pagina_plantas(datos=datos_cliente)
+    try:
+        with medir_etapa("firma"):
+            datos_cliente['firma_cliente'] = _firma_normalizada(datos_cliente.get('firma_cliente'))
+        token = borradores.guardar(None, datos_cliente)
+    except FirmaInvalida as e:
+        logging.warning("⚠️ Firma rechazada: %s", e)
+        return _volver_al_formulario(datos_cliente, f'⚠️ La firma no es válida: {e}. Vuelve a firmar el formulario.')
+    except BorradorDemasiadoGrande:
+        return _volver_al_formulario(
+            datos_cliente, '⚠️ El formulario es demasiado grande. Revisa los datos introducidos y vuelve a firmar.')
+    # POST/redirect/GET: recargar la página de plantas no reenvía el formulario del cliente
+    respuesta = redirect(url_for('plantas'))
+    respuesta.set_cookie(COOKIE_BORRADOR, token, max_age=BORRADOR_TTL, httponly=True,
+                         samesite="Lax", secure=request.is_secure)
+    return respuesta
 
 @app.route('/guardar', methods=['POST'])
 def guardar():
-    form_data = request.form.to_dict()
     plantas_data = request.form.to_dict()
-    data = {**form_data, **plantas_data}
-
-    # Firma base64 (canvas)
-    firma_base64 = data.get('firma_cliente')
-    firma_bytes = None
-    if firma_base64:
-        try:
-            firma_bytes = base64.b64decode(firma_base64.split(",")[1])
-        except Exception:
-            firma_bytes = None
+    token = plantas_data.pop("borrador", None)
+    id_envio = plantas_data.pop("id_envio", None)
+    if _alta_ya_recibida(id_envio):
+        # Doble clic o recarga de un alta ya entregada: su borrador ya se ha borrado
+        return _gracias(token)
+    if token:
+        borrador = borradores.obtener(token) if borradores else None
+        if borrador is None:
+            flash('⚠️ Los datos del cliente han caducado. Vuelve a rellenar el formulario.')
+            return redirect('/')
+        data = {**borrador, **plantas_data}
+    else:
+        # Sin borrador (BORRADORES=false o página antigua): todo llega en este POST
+        data = plantas_data
 
     # Validación mínima: al menos una planta
-    hay_una_planta = any(plantas_data.get(f'planta_nombre_{i}') for i in range(1, 11))
-    if not hay_una_planta:
+    if not hay_alguna_planta(plantas_data):
         flash('⚠️ Debes rellenar al menos los datos de una planta antes de continuar.')
-        return render_template('plantas.html', datos_cliente=form_data)
+        return _volver_a_plantas(token, data, plantas_data)
+
+    # Firma base64 (canvas): se valida y reduce en memoria antes de generar nada
+    try:
+        with medir_etapa("firma"):
+            firma_bytes = procesar_firma(
+                data.get('firma_cliente'), FIRMA_ANCHO, FIRMA_ALTO,
+                max_data_url=FIRMA_MAX_DATA_URL, max_bytes=FIRMA_MAX_BYTES,
+            )
+    except FirmaInvalida as e:
+        # La firma solo se puede repetir en el paso 1 (la página de plantas no tiene el canvas)
+        logging.warning("⚠️ Firma rechazada: %s", e)
+        return _volver_al_formulario(data, f'⚠️ La firma no es válida: {e}. Vuelve a firmar el formulario.')
 
     # Generar Excels
     try:
-        excel_cliente = crear_excel_en_memoria(data, firma_bytes)
-        excel_plantas = crear_excel_plantas_en_memoria(data)
+        with medir_etapa("excel_cliente"):
+            excel_cliente = crear_excel_en_memoria(data, firma_bytes)
+        with medir_etapa("excel_plantas"):
+            excel_plantas = crear_excel_plantas_en_memoria(data)
     except Exception as e:
         logging.exception("❌ Error generando Excels")
         flash(f'Error generando Excels: {e}')
-        return render_template('plantas.html', datos_cliente=form_data)
+        return _volver_a_plantas(token, data, plantas_data)
 
     if not GAS_WEBHOOK_URL:
         logging.error("❌ GAS_WEBHOOK_URL no configurado")
@@ -77,109 +260,400 @@ def guardar():
 
     nombre_cliente = data.get('nombre') or "cliente"
     correo_comercial = data.get('correo_comercial')
+    clave = request.headers.get("Idempotency-Key") or _clave_idempotencia(id_envio)
 
     if FORCE_SYNC_SEND:
+        _archivar(clave, data, excel_cliente.getvalue(), excel_plantas.getvalue(), correo_comercial)
         ok, detalle = enviar_un_correo_con_dos_adjuntos(excel_cliente, excel_plantas, correo_comercial, nombre_cliente)
+        _marcar_archivo({"id_alta": clave}, bool(ok), detalle)  # sin cola, circuito abierto = error
         flash('Documentación enviada correctamente.' if ok else f'Error enviando: {detalle}')
-        return render_template("gracias.html")
+        return _gracias(token if ok else None)
     else:
-        threading.Thread(
-            target=_thread_enviar_unico,
-            args=(excel_cliente, excel_plantas, correo_comercial, nombre_cliente),
-            daemon=True
-        ).start()
-        return render_template("gracias.html")
-
-def _thread_enviar_unico(archivo1, archivo2, correo, nombre):
-    try:
-        ok, detalle = enviar_un_correo_con_dos_adjuntos(archivo1, archivo2, correo, nombre)
-        if ok:
-            logging.info("✅ Envío (1 correo, 2 adjuntos): %s", detalle)
-        else:
-            logging.error("❌ Fallo de envío (1 correo): %s", detalle)
-    except Exception as e:
-        logging.exception("❌ Excepción en hilo de envío: %s", e)
-
-# ===== Funciones Excel =====
-def crear_excel_en_memoria(data, firma_bytes=None):
-    wb = load_workbook("Copia de Alta de Cliente.xlsx")
-    ws = wb["FICHA CLIENTE"]
-
-    ws["B4"] = data.get("nombre")
-    ws["B5"] = data.get("nif")
-    ws["D5"] = data.get("telefono_general")
-    ws["B6"] = data.get("email_general")
-    ws["D6"] = data.get("web")
-    ws["B7"] = data.get("direccion")
-    ws["D7"] = data.get("cp")
-    ws["B8"] = data.get("poblacion")
-    ws["D8"] = data.get("provincia")
-    ws["B13"] = data.get("forma_pago")
-    ws["B18"] = data.get("compras_nombre")
-    ws["D18"] = data.get("compras_telefono")
-    ws["B19"] = data.get("compras_email")
-    ws["B22"] = data.get("contabilidad_nombre")
-    ws["D22"] = data.get("contabilidad_telefono")
-    ws["B24"] = data.get("contabilidad_email")
-    ws["B27"] = data.get("facturacion_nombre")
-    ws["D27"] = data.get("facturacion_telefono")
-    ws["B29"] = data.get("facturacion_email")
-    ws["B32"] = data.get("descarga_nombre")
-    ws["D32"] = data.get("descarga_telefono")
-    ws["B34"] = data.get("descarga_email")
-    ws["C38"] = data.get("contacto_documentacion")
-    ws["C39"] = data.get("contacto_devoluciones")
-    ws["B43"] = data.get("sepa_nombre_banco")
-    ws["B44"] = data.get("sepa_domicilio_banco")
-    ws["B45"] = data.get("sepa_cp")
-    ws["B46"] = data.get("sepa_poblacion")
-    ws["B47"] = data.get("sepa_provincia")
-    ws["B48"] = data.get("iban_completo")
-
-    if firma_bytes:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-            tmp.write(firma_bytes)
-            tmp_path = tmp.name
-        try:
-            img = ExcelImage(tmp_path)
-            img.width = 200
-            img.height = 60
-            ws.add_image(img, "B49")
-        finally:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
-
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return bio
-
-def crear_excel_plantas_en_memoria(data):
-    wb = load_workbook("Copia de Alta de Plantas.xlsx")
-    ws = wb["Plantas"]
-
-    columnas = ["B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M"]
-    campos = [
-        "planta_nombre_{}", "planta_direccion_{}", "planta_cp_{}", "planta_poblacion_{}",
-        "planta_provincia_{}", "planta_telefono_{}", "planta_email_{}", "planta_horario_{}",
-        "planta_observaciones_{}", "planta_contacto_nombre_{}", "planta_contacto_telefono_{}",
-        "planta_contacto_email_{}"
+        # El worker de la cola archiva el alta antes de enviarla (_preparar_alta)
+        with medir_etapa("encolar"):
+            outbox.encolar({
+                "id_alta": clave,
+                "cliente": excel_cliente.getvalue(),
+                "plantas": excel_plantas.getvalue(),
+                "correo": correo_comercial,
+                "nombre": nombre_cliente,
+                "nif": data.get("nif"),
+            }, clave=clave)
+        return _gracias(token)
+
+def _alta_ya_recibida(id_envio):
+    # En la cola (salvo si agotó sus intentos) o, con FORCE_SYNC_SEND, en el archivo sin error
+    if not id_envio or not RE_ID_ENVIO.fullmatch(id_envio):
+        return False
+    trabajo = outbox.consultar(id_envio)
+    if trabajo is not None:
+        return trabajo["estado"] != FALLIDO
+    alta = archivo.obtener(id_envio) if archivo else None
+    return alta is not None and alta["estado"] != ERROR_ARCHIVO
+
+def _gracias(token):
+    # Alta entregada: el borrador ya no hace falta
+    respuesta = make_response(render_template("gracias.html"))
+    if token:
+        borradores.eliminar(token)
+        respuesta.delete_cookie(COOKIE_BORRADOR)
+    return respuesta
+
+@app.route('/admin/plantillas', methods=['GET'])
+@requiere_admin
+def admin_plantillas():
+    return jsonify({
+        "motor": EXCEL_MOTOR,
+        "openpyxl": cache_plantillas.estadisticas(),
+        "xml": cache_plantillas_xml.estadisticas(),
+    })
+
+@app.route('/admin/borradores', methods=['GET'])
+@requiere_admin
+def admin_borradores():
+    return jsonify(borradores.estadisticas() if borradores else {"activo": False})
+
+@app.route('/admin/outbox', methods=['GET'])
+@requiere_admin
+def admin_outbox():
+    return jsonify(outbox.estadisticas())
+
+@app.route('/admin/webhook', methods=['GET'])
+@requiere_admin
+def admin_webhook():
+    return jsonify(cliente_webhook.estadisticas())
+
+@app.route('/metrics', methods=['GET'])
+@requiere_admin
+def metricas():
+    # Formato texto de Prometheus. Las métricas son por proceso (worker de gunicorn)
+    cola = outbox.estadisticas()
+    webhook = cliente_webhook.estadisticas()
+    lineas = [
+        *exportar_histograma("formulario_etapa_segundos", "Duración de cada etapa del alta",
+                             duracion_etapas, "etapa"),
+        *exportar_histograma("formulario_peticion_segundos", "Duración de las peticiones HTTP",
+                             duracion_peticiones, "ruta"),
+        *exportar_histograma("formulario_excel_bytes", "Tamaño de los Excel generados", tamano_excel, "tipo"),
+        *exportar_histograma("formulario_webhook_segundos", "Latencia del POST al webhook",
+                             cliente_webhook.latencias, "resultado"),
+        *exportar_histograma("formulario_webhook_payload_bytes", "Bytes enviados al webhook por POST",
+                             cliente_webhook.bytes_payload),
+        *exportar_valores("formulario_webhook_envios_total", "counter", "Envíos al webhook por resultado",
+                          webhook["resultados"], "resultado"),
+        *exportar_valores("formulario_webhook_circuito_abierto", "gauge", "1 si el circuito del webhook está abierto",
+                          int(webhook["circuito"] == "abierto")),
+        *exportar_valores("formulario_webhook_aperturas_circuito_total", "counter",
+                          "Veces que se ha abierto el circuito", webhook["aperturas_circuito"]),
+        *exportar_valores("formulario_outbox_trabajos", "gauge", "Trabajos de la cola por estado", {
+            "pendiente": cola["pendientes"], "en_curso": cola["en_curso"],
+            "enviado": cola["enviados"], "fallido": cola["fallidos"],
+        }, "estado"),
+        *exportar_valores("formulario_outbox_en_vuelo", "gauge", "Trabajos en ejecución en este proceso",
+                          cola["en_vuelo_este_proceso"]),
+        *exportar_valores("formulario_outbox_antiguedad_pendiente_segundos", "gauge",
+                          "Antigüedad del trabajo pendiente más viejo", cola["antiguedad_pendiente_s"]),
+        *exportar_valores("formulario_hilos", "gauge", "Hilos vivos en el proceso", threading.active_count()),
+        *exportar_valores("formulario_perfiles_guardados_total", "counter", "Perfiles cProfile guardados",
+                          perfilador.guardados),
     ]
+    return Response("\n".join(lineas) + "\n", mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+_importaciones = None
+_lock_importaciones = threading.Lock()
+
+def _gestor_importaciones():
+    # pandas solo se carga si se usa la importación
+    global _importaciones
+    with _lock_importaciones:
+        if _importaciones is None:
+            import importacion
+            _importaciones = importacion.ImportacionesEnSegundoPlano()
+    return _importaciones
+
+@app.route('/admin/importar', methods=['POST'])
+@requiere_admin
+def admin_importar():
+    # Sube un CSV/XLSX con una fila por cliente; destino=zip (por defecto) deja los
+    # Excel generados en un zip, destino=envio los encola como si llegaran de /guardar.
+    # Responde 202 en cuanto lee el fichero: la generación sigue en segundo plano
+    import importacion
+
+    fichero = request.files.get("fichero")
+    if not fichero or not fichero.filename:
+        return jsonify(error="Falta el fichero (campo 'fichero')"), 400
+    destino = request.form.get("destino", "zip")
+    if destino not in ("zip", "envio"):
+        return jsonify(error="destino debe ser 'zip' o 'envio'"), 400
+    if destino == "envio" and not GAS_WEBHOOK_URL:
+        return jsonify(error="Falta GAS_WEBHOOK_URL en el servidor"), 503
+    try:
+        filas = importacion.leer_altas(io.BytesIO(fichero.read()), fichero.filename)
+    except importacion.ImportacionInvalida as e:
+        return jsonify(error=str(e)), 400
+
+    id_importacion = _gestor_importaciones().lanzar(filas, fichero.filename, destino, encolar_importacion)
+    url_estado = url_for('admin_importacion', id_importacion=id_importacion)
+    return jsonify(id=id_importacion, filas=len(filas), estado_url=url_estado), 202, {"Location": url_estado}
+
+@app.route('/admin/importar/<id_importacion>', methods=['GET'])
+@requiere_admin
+def admin_importacion(id_importacion):
+    estado = _gestor_importaciones().estado(id_importacion)
+    if estado is None:
+        return jsonify(error="Importación no encontrada"), 404
+    if estado["estado"] == "terminada" and estado["destino"] == "zip":
+        estado["zip_url"] = url_for('admin_importacion_zip', id_importacion=id_importacion)
+    return jsonify(id=id_importacion, **estado)
+
+@app.route('/admin/importar/<id_importacion>/altas.zip', methods=['GET'])
+@requiere_admin
+def admin_importacion_zip(id_importacion):
+    gestor = _gestor_importaciones()
+    ruta = gestor.ruta_zip(id_importacion)
+    if ruta is None:
+        abort(404)
+    resumen = gestor.estado(id_importacion).get("resumen", {})
+    respuesta = send_file(ruta, mimetype="application/zip", as_attachment=True, download_name="altas_importadas.zip")
+    respuesta.headers["X-Importacion-Generadas"] = str(resumen.get("generadas", ""))
+    respuesta.headers["X-Importacion-Errores"] = str(resumen.get("errores", ""))
+    return respuesta
+
+# ===== Archivo =====
+def _archivar(id_alta, data, cliente, plantas, correo, etapas=None):
+    # Un fallo del archivo no debe impedir el envío: se registra y se sigue
+    if not archivo:
+        return
+    try:
+        with medir_etapa("archivo", etapas):
+            archivo.archivar(id_alta, data, cliente, plantas, correo)
+    except Exception:
+        logging.exception("❌ Error archivando el alta %s", id_alta)
+
+def _marcar_archivo(datos, ok, detalle):
+    # Los reenvíos actualizan el alta archivada original. ok=None (circuito abierto):
+    # el alta sigue pendiente, la cola la reintentará
+    id_archivo = datos.get("archivada") or datos.get("id_alta")
+    if not archivo or not id_archivo or ok is None:
+        return
+    try:
+        archivo.marcar(id_archivo, ok, detalle)
+    except Exception:
+        logging.exception("❌ Error actualizando el alta archivada %s", id_archivo)
+
+def _fecha(texto):
+    # "AAAA-MM-DD" -> timestamp local; ValueError si no es válida
+    return time.mktime(time.strptime(texto, "%Y-%m-%d"))
+
+def _alta_archivada(id_alta):
+    alta = archivo.obtener(id_alta) if archivo else None
+    if alta is None:
+        abort(404)
+    return alta
+
+@app.route('/admin/archivo', methods=['GET'])
+@requiere_admin
+def admin_archivo():
+    # ?nif=...&nombre=...&desde=AAAA-MM-DD&hasta=AAAA-MM-DD&limite=50
+    if not archivo:
+        return jsonify(error="Archivo desactivado (ARCHIVO=false)"), 404
+    try:
+        desde = _fecha(request.args["desde"]) if request.args.get("desde") else None
+        hasta = _fecha(request.args["hasta"]) + 86400 if request.args.get("hasta") else None
+        limite = min(int(request.args.get("limite", "50")), 500)
+    except ValueError:
+        return jsonify(error="Parámetros no válidos: fechas AAAA-MM-DD y limite numérico"), 400
+    altas = archivo.buscar(request.args.get("nif"), request.args.get("nombre"), desde, hasta, limite)
+    return jsonify(altas=altas, total=len(altas), estadisticas=archivo.estadisticas())
+
+@app.route('/admin/archivo/<id_alta>', methods=['GET'])
+@requiere_admin
+def admin_archivo_alta(id_alta):
+    alta = _alta_archivada(id_alta)
+    alta["cola"] = outbox.consultar(id_alta)  # estado en vivo (None si no pasó por la cola)
+    alta["ficheros"] = {
+        tipo: url_for('admin_archivo_fichero', id_alta=id_alta, tipo=tipo) for tipo in ("cliente", "plantas")
+    }
+    return jsonify(alta)
+
+@app.route('/admin/archivo/<id_alta>/<tipo>.xlsx', methods=['GET'])
+@requiere_admin
+def admin_archivo_fichero(id_alta, tipo):
+    if tipo not in ("cliente", "plantas"):
+        abort(404)
+    alta = _alta_archivada(id_alta)
+    ruta = archivo.ruta_fichero(alta[f"hash_{tipo}"])
+    if ruta is None or not os.path.exists(ruta):
+        return jsonify(error="El fichero archivado ya no está en disco"), 410
+    return send_file(
+        ruta, as_attachment=True, download_name=f"Copia Alta de {tipo.capitalize()} - {alta['nombre']}.xlsx",
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
+
+@app.route('/admin/archivo/<id_alta>/reenviar', methods=['POST'])
+@requiere_admin
+def admin_archivo_reenviar(id_alta):
+    # Reenvía los Excel archivados tal cual, sin volver a generarlos
+    alta = _alta_archivada(id_alta)
+    cliente = archivo.leer_fichero(alta["hash_cliente"])
+    plantas = archivo.leer_fichero(alta["hash_plantas"])
+    if cliente is None or plantas is None:
+        return jsonify(error="Los ficheros archivados no están en disco o no coinciden con su hash"), 410
+    if not GAS_WEBHOOK_URL:
+        return jsonify(error="Falta GAS_WEBHOOK_URL en el servidor"), 503
+
+    id_reenvio = f"{id_alta}-reenvio-{uuid.uuid4().hex[:8]}"
+    outbox.encolar({
+        "id_alta": id_reenvio,
+        "archivada": id_alta,
+        "cliente": cliente,
+        "plantas": plantas,
+        "correo": alta["correo"],
+        "nombre": alta["nombre"],
+    }, clave=id_reenvio)
+    url_estado = url_for('api_estado_alta', id_alta=id_reenvio)
+    return jsonify(id=id_reenvio, archivada=id_alta, estado_url=url_estado), 202, {"Location": url_estado}
+
+# ===== API asíncrona =====
+@app.route('/api/altas', methods=['POST'])
+def api_crear_alta():
+    # Acepta JSON o formulario; valida, encola la generación + envío y responde 202
+    clave_cliente = request.headers.get("Idempotency-Key")
+    if clave_cliente is not None and not RE_IDEMPOTENCY_KEY.fullmatch(clave_cliente):
+        return jsonify(error="Idempotency-Key no válida: de 1 a 64 caracteres A-Z, a-z, 0-9, '_' o '-'"), 400
+    if request.is_json:
+        datos = request.get_json(silent=True)
+        if not isinstance(datos, dict):
+            return jsonify(error="JSON no válido: se esperaba un objeto"), 400
+    else:
+        datos = request.form.to_dict()
+
+    errores = validar_alta(datos)
+    if errores:
+        return jsonify(error="Datos no válidos", detalles=errores), 400
+    try:
+        with medir_etapa("firma"):
+            firma_bytes = procesar_firma(
+                datos.get('firma_cliente'), FIRMA_ANCHO, FIRMA_ALTO,
+                max_data_url=FIRMA_MAX_DATA_URL, max_bytes=FIRMA_MAX_BYTES,
+            )
+    except FirmaInvalida as e:
+        return jsonify(error=f"Firma no válida: {e}"), 400
+    if not GAS_WEBHOOK_URL:
+        return jsonify(error="Falta GAS_WEBHOOK_URL en el servidor"), 503
+
+    # Prefijo "api-": una clave del cliente no choca con los id_envio de /guardar ni
+    # con las importaciones
+    id_alta = f"api-{clave_cliente or uuid.uuid4().hex}"
+    _, nuevo = outbox.encolar({
+        "id_alta": id_alta,
+        "formulario": {k: v for k, v in datos.items() if k != "firma_cliente"},
+        "firma": firma_bytes,
+        "correo": datos.get("correo_comercial"),
+        "nombre": datos.get("nombre") or "cliente",
+    }, clave=id_alta)
+    url_estado = url_for('api_estado_alta', id_alta=id_alta)
+    respuesta = jsonify(id=id_alta, duplicado=not nuevo, estado_url=url_estado)
+    return respuesta, 202, {"Location": url_estado}
+
+@app.route('/api/altas/<id_alta>', methods=['GET'])
+def api_estado_alta(id_alta):
+    trabajo = outbox.consultar(id_alta)
+    if trabajo is None:
+        return jsonify(error="Alta no encontrada"), 404
+    etapas = trabajo.pop("etapas")
+    trabajo["etapas_ms"] = {k: round(v * 1000, 3) for k, v in etapas.items()}
+    trabajo["id"] = id_alta  # el id interno de la cola no se expone
+    return jsonify(trabajo)
+
+# ===== Cola de envíos =====
+def _clave_idempotencia(id_envio):
+    # La clave es el id_envio de la página de plantas (uno por rellenado), no los datos:
+    # volver a dar de alta el mismo cliente más adelante es un alta nueva. Si falta o
+    # no tiene el formato esperado (página antigua en caché) no hay deduplicación.
+    if id_envio and RE_ID_ENVIO.fullmatch(id_envio):
+        return id_envio
+    return uuid.uuid4().hex
+
+def _preparar_alta(datos, etapas):
+    # Las altas de /guardar y de la importación llegan con los Excel ya generados; las
+    # de la API, con el formulario: se generan aquí, en el worker de la cola, midiendo
+    # cada etapa. El archivo también se escribe aquí, fuera de la petición
+    if "cliente" in datos:
+        alta, indice = datos, {"nombre": datos["nombre"], "nif": datos.get("nif")}
+    else:
+        with medir_etapa("excel_cliente", etapas):
+            cliente = crear_excel_en_memoria(datos["formulario"], datos.get("firma"))
+        with medir_etapa("excel_plantas", etapas):
+            plantas = crear_excel_plantas_en_memoria(datos["formulario"])
+        alta, indice = {**datos, "cliente": cliente.getvalue(), "plantas": plantas.getvalue()}, datos["formulario"]
+    if not datos.get("archivada"):  # los reenvíos salen del archivo
+        _archivar(datos["id_alta"], indice, alta["cliente"], alta["plantas"], datos.get("correo"), etapas)
+    return alta
+
+def encolar_importacion(generadas):
+    # Altas de la importación masiva: mismo camino que /guardar, una entrada por alta.
+    # Cada importación es nueva: la clave es el id de la importación + la fila
+    id_importacion = uuid.uuid4().hex[:12]
+    encoladas = []
+    for alta in generadas:
+        clave = f"importacion-{id_importacion}-{alta['fila']}"
+        _, nueva = outbox.encolar({
+            "id_alta": clave,
+            "cliente": alta["cliente"],
+            "plantas": alta["plantas"],
+            "correo": alta["correo"],
+            "nombre": alta["nombre"],
+            "nif": alta["datos"].get("nif"),
+        }, clave=clave)
+        encoladas.append({"fila": alta["fila"], "id": clave, "nueva": nueva})
+    return encoladas
+
+def _anotar_etapas(datos, etapas):
+    if datos.get("id_alta") and etapas:
+        outbox.anotar_etapas(datos["id_alta"], etapas)
+
+def _procesar_envio(datos):
+    etapas = {}
+    try:
+        alta = _preparar_alta(datos, etapas)
+        ok, detalle = enviar_un_correo_con_dos_adjuntos(
+            io.BytesIO(alta["cliente"]), io.BytesIO(alta["plantas"]), alta["correo"], alta["nombre"],
+            etapas=etapas,
+        )
+    finally:
+        _anotar_etapas(datos, etapas)
+    _marcar_archivo(datos, ok, detalle)
+    return ok, detalle
 
-    for i in range(1, 10+1):
-        fila = 3 + i  # i=1 -> fila 4
-        valores = [data.get(campo.format(i), "") for campo in campos]
-        if not valores[0]:
-            continue
-        for col, valor in zip(columnas, valores):
-            ws[f"{col}{fila}"] = valor
+def _procesar_lote(lista_datos):
+    # Un fallo al generar los Excel de un alta no impide enviar el resto del lote
+    resultados = [None] * len(lista_datos)
+    preparadas, etapas_por_alta = [], []
+    for i, datos in enumerate(lista_datos):
+        etapas = {}
+        try:
+            preparadas.append((i, _preparar_alta(datos, etapas)))
+        except Exception as e:
+            logging.exception("❌ Error generando Excels del alta %s", datos.get("id_alta"))
+            resultados[i] = (False, f"Error generando Excels: {e}")
+        etapas_por_alta.append(etapas)
+
+    # Un correo por grupo de destinatarios: un comercial nunca recibe las altas de otro
+    grupos = {}
+    for i, alta in preparadas:
+        grupos.setdefault(_build_recipients(alta.get("correo")), []).append((i, alta))
+    for grupo in grupos.values():
+        etapas_envio = {}
+        enviados = enviar_lote_de_altas([alta for _, alta in grupo], etapas=etapas_envio)
+        for (i, _), resultado in zip(grupo, enviados):
+            resultados[i] = resultado
+            etapas_por_alta[i].update(etapas_envio)
+    for datos, etapas, (ok, detalle) in zip(lista_datos, etapas_por_alta, resultados):
+        _anotar_etapas(datos, etapas)
+        _marcar_archivo(datos, ok, detalle)
+    return resultados
 
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return bio
 
 # ===== Envío por Webhook (1 correo con 2 adjuntos) =====
 def _build_recipients(correo_comercial):
@@ -191,30 +665,33 @@ def _build_recipients(correo_comercial):
     return ",".join(dest)
 
 def _encode_attachment(bytes_io, filename):
-    bytes_io.seek(0)
-    raw = bytes_io.getvalue()
-    b64 = base64.b64encode(raw).decode("utf-8")
-    # Enviamos "content" y "base64" para compatibilidad con cualquier Apps Script
-    return {
-        "filename": filename,
-        "mimeType": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        "content": b64,
-        "base64": b64,
-        "raw_size": len(raw),
+    # Sin copia: el base64 se genera por trozos al escribir el cuerpo en el socket,
+    # una sola vez por campo configurado en WEBHOOK_CAMPO_ADJUNTO
+    return Adjunto(
+        filename=filename,
+        mimeType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        datos=bytes_io.getbuffer(),
+    )
+
+def _construir_payload(campos, adjuntos):
+    return CuerpoJson(campos, adjuntos, campos_adjunto=WEBHOOK_CAMPO_ADJUNTO, gzip=WEBHOOK_GZIP)
+
+def _post_to_webhook(payload, etapas=None):
+    t0 = time.perf_counter()
+    ok, detalle = cliente_webhook.enviar(payload)
+    # El base64 se genera mientras se escribe en el socket: lo separamos del tiempo de red
+    total = time.perf_counter() - t0
+    tiempos = {
+        "codificacion": payload.segundos_codificacion,
+        "webhook": max(0.0, total - payload.segundos_codificacion),
     }
+    for etapa, segundos in tiempos.items():
+        duracion_etapas.observar(segundos, etapa)
+    if etapas is not None:
+        etapas.update(tiempos)
+    return ok, detalle
 
-def _post_to_webhook(payload):
-    try:
-        r = requests.post(GAS_WEBHOOK_URL, json=payload, timeout=30)
-        logging.info("Webhook status=%s body=%s", r.status_code, r.text[:400])
-        if r.status_code == 200 and "OK" in r.text:
-            return True, f"status={r.status_code}"
-        return False, f"Webhook error status={r.status_code} body={r.text[:400]}"
-    except Exception as e:
-        logging.exception("Excepción en requests.post")
-        return False, f"Excepción: {e}"
-
-def enviar_un_correo_con_dos_adjuntos(archivo_cliente, archivo_plantas, correo_comercial, nombre_cliente):
+def enviar_un_correo_con_dos_adjuntos(archivo_cliente, archivo_plantas, correo_comercial, nombre_cliente, etapas=None):
     if not GAS_WEBHOOK_URL:
         return False, "Falta GAS_WEBHOOK_URL"
 
@@ -225,157 +702,59 @@ def enviar_un_correo_con_dos_adjuntos(archivo_cliente, archivo_plantas, correo_c
     att1 = _encode_attachment(archivo_cliente, f"Copia Alta de Cliente - {nombre_cliente}.xlsx")
     att2 = _encode_attachment(archivo_plantas, f"Copia Alta de Plantas - {nombre_cliente}.xlsx")
 
-    payload = {
+    payload = _construir_payload({
         "to": to_csv,
         "subject": subject,
-        "text": "Adjuntamos la documentación del alta (Cliente y Plantas).",
+        "text": construir_body_texto(nombre_cliente),
         "html": body_html,
-        "attachments": [
-            {k: v for k, v in att1.items() if k != "raw_size"},
-            {k: v for k, v in att2.items() if k != "raw_size"}
-        ]
-    }
+    }, [att1, att2])
 
-    ok, detalle = _post_to_webhook(payload)
+    ok, detalle = _post_to_webhook(payload, etapas)
     return ok, detalle
 
-def construir_body_html(nombre_cliente):
-    # Cuerpo completo con las tablas (riesgo, sector y subsectores)
-    return f"""
-    <html>
-    <body>
-    <p>Buenas,</p>
-    <p>Se ha completado el alta de un nuevo cliente en el sistema: <strong>{nombre_cliente}</strong>.</p>
-    <p>Adjuntamos en este correo dos archivos Excel:<br>
-    - Uno con los datos generales del cliente.<br>
-    - Otro con la información detallada de sus plantas.</p>
-
-    <p><strong><span style='color:red;'>⚠️ IMPORTANTE: REENVIAR ESTE CORREO A MIGUEL INDICANDO EL RIESGO A SOLICITAR PARA ESTE CLIENTE, SECTOR Y SUBSECTOR.</span></strong></p>
-
-    <p><strong>Seleccione el riesgo, el sector y el subsector marcando la casilla correspondiente:</strong></p>
-
-    <table style="width: 100%; border-collapse: collapse;" cellspacing="15">
-        <tr>
-            <td style="vertical-align: top;">
-                <table style="border-collapse: collapse; border: 1px solid black;">
-                    <thead>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Riesgo</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                    </thead>
-                    <tbody>
-                        <tr><td style="padding:5px; border:1px solid black;">0</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">500</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">1000</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">1500</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">2000</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">2500</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">3000</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">3500</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">4000</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">4500</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">5000</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">20000</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Otro (especificar)</td><td style="padding:5px; border:1px solid black;"><input type="text" placeholder="Escriba aquí el riesgo"></td></tr>
-                    </tbody>
-                </table>
-            </td>
-
-            <td style="vertical-align: top;">
-                <table style="border-collapse: collapse; border: 1px solid black;">
-                    <thead>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Sector</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                    </thead>
-                    <tbody>
-                        <tr><td style="padding:5px; border:1px solid black;">Agricultura</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Aguas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Alimentación</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Distribuidor</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Ganadería</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Industrial</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Piscinas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">Sector0</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                    </tbody>
-                </table>
-            </td>
-
-            <td style="vertical-align: top;">
-                <table style="border-collapse: collapse; border: 1px solid black;">
-                    <thead>
-                        <tr><th colspan="2" style="padding: 5px; border: 1px solid black;">Subsectores</th></tr>
-                    </thead>
-                    <tbody>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Agricultura</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AG)Agricultura</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Aguas</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(A)Industrial</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(A)Potable</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(A)Residual</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Alimentación</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Aceituna</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Aditivos, aromas, azucares y salsas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Bebidas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Cárnicas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Chocolate, café y confiteria</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Conserva - procesado frutas, hortalizas y cereales</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Grasas animales y vegetales</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Lácteos</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Panadería,pasta,harina,galletas, y pasteleria</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Pescado</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(AL)Vino</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Distribuidor</th><th style="padding: 5 px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(D)Agricultura</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(D)Aguas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(D)Alimentación</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(D)Ganadería</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(D)Industrial</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(D)Piscinas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Ganadería</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(G)Explotaciones Ganaderas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(G)Fabricación Alimentos FEED</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Industrial</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Biodiésel</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Cemento,yeso y hormigón</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Comercio</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Construcción</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Detergencia y Cosmética</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Energía</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Energía Renovable</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Farmacia</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Fertilizantes y agroquímicos</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Madera</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Metalurgia</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Minerales</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Papel y cartón</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Petróleo y gas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Pinturas,barnices,resinas,masillas,tintas</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Plástico</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Química básica</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Química fina / formulados</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Residuos</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Textil y curtidos</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Transportes</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(I)Vidrio y Cerámica</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Piscinas</th><th style="padding: 5px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(P)Privada</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(P)Pública</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                        <tr><th style="padding: 5px; border: 1px solid black;">Sector 0</th><th style="padding: 5 px; border: 1px solid black;">Selección</th></tr>
-                        <tr><td style="padding:5px; border:1px solid black;">(S)Sector 0</td><td style="padding:5px; border:1px solid black;"><input type="checkbox"></td></tr>
-                    </tbody>
-                </table>
-            </td>
-        </tr>
-    </table>
-
-    <p>Gracias por vuestra colaboración.</p>
-    <p>Un saludo,<br>Departamento de Tesorería</p>
-    </body>
-    </html>
-    """
+def enviar_lote_de_altas(altas, etapas=None):
+    # Modo lote: un único correo con los dos adjuntos de cada alta. Todas las altas
+    # deben tener los mismos destinatarios (_procesar_lote las agrupa). Devuelve un
+    # resultado por alta para que la cola haga el seguimiento individual.
+    if not GAS_WEBHOOK_URL:
+        return [(False, "Falta GAS_WEBHOOK_URL")] * len(altas)
+
+    destinatarios = {_build_recipients(alta.get("correo")) for alta in altas}
+    if len(destinatarios) != 1:
+        raise ValueError("enviar_lote_de_altas: las altas de un lote deben tener los mismos destinatarios")
+    adjuntos = []
+    for alta in altas:
+        nombre = alta["nombre"]
+        for clave, titulo in (("cliente", "Cliente"), ("plantas", "Plantas")):
+            adjuntos.append(_encode_attachment(io.BytesIO(alta[clave]), f"Copia Alta de {titulo} - {nombre}.xlsx"))
+
+    nombres = [alta["nombre"] for alta in altas]
+    payload = _construir_payload({
+        "to": destinatarios.pop(),
+        "subject": f"Altas de clientes: {len(altas)} nuevas — Documentación",
+        "text": construir_body_texto_lote(nombres),
+        "html": construir_body_html_lote(nombres),
+    }, adjuntos)
+
+    ok, detalle = _post_to_webhook(payload, etapas)
+    return [(ok, f"lote de {len(altas)}: {detalle}")] * len(altas)
+
+# ===== Arranque de la cola =====
+outbox = Outbox(
+    OUTBOX_DB, _procesar_envio,
+    workers=OUTBOX_WORKERS,
+    max_intentos=OUTBOX_MAX_INTENTOS,
+    backoff_base=OUTBOX_BACKOFF_BASE,
+    backoff_max=OUTBOX_BACKOFF_MAX,
+    manejador_lote=_procesar_lote if ENVIO_LOTES else None,
+    lote_max=LOTE_MAX,
+    lote_ventana=LOTE_VENTANA,
+    aplazamiento=cliente_webhook.circuito.segundos_para_reintento,
+    retencion=OUTBOX_RETENCION,
+)
+outbox.iniciar()
+atexit.register(outbox.detener, OUTBOX_DRAIN_TIMEOUT)
 
 # ===== Main =====
 if __name__ == '__main__':
     app.run(debug=True)
-
-
-
-
-
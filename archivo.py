@@ -0,0 +1,179 @@
+# Archivo de las altas enviadas: los dos Excel de cada alta se guardan en
+# formularios_guardados/AAAA/MM/DD/<sha256>.xlsx (el nombre es el hash del
+# contenido, así un fichero idéntico se guarda una sola vez) y un índice SQLite
+# compacto permite buscar por NIF o nombre, ver el estado del envío y
+# reenviar un alta sin volver a generarla.
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS altas (
+    id            TEXT PRIMARY KEY,       -- clave de idempotencia del alta
+    nif           TEXT,
+    nombre        TEXT NOT NULL,
+    nombre_busqueda TEXT NOT NULL,        -- nombre en minúsculas y sin acentos
+    correo        TEXT,
+    creado        REAL NOT NULL,
+    estado        TEXT NOT NULL,
+    detalle       TEXT,
+    actualizado   REAL NOT NULL,
+    hash_cliente  TEXT NOT NULL,
+    hash_plantas  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS altas_nif ON altas (nif);
+CREATE INDEX IF NOT EXISTS altas_creado ON altas (creado);
+CREATE TABLE IF NOT EXISTS ficheros (
+    hash   TEXT PRIMARY KEY,
+    ruta   TEXT NOT NULL,                 -- relativa al directorio del archivo
+    bytes  INTEGER NOT NULL
+);
+"""
+
+PENDIENTE = "pendiente"
+ENVIADO = "enviado"
+ERROR = "error"
+
+
+def normalizar_nif(nif):
+    return re.sub(r"[\s.\-]", "", nif or "").upper() or None
+
+
+def _texto_busqueda(texto):
+    sin_acentos = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode("ascii")
+    return sin_acentos.lower().strip()
+
+
+class ArchivoAltas:
+    def __init__(self, directorio, ruta_db=None):
+        self.directorio = directorio
+        self.ruta_db = ruta_db or os.path.join(directorio, "indice.sqlite3")
+        self._local = threading.local()
+        os.makedirs(directorio, exist_ok=True)
+        with self._conectar() as con:
+            con.executescript(_ESQUEMA)
+
+    @contextmanager
+    def _conectar(self):
+        # Una conexión por hilo, reutilizada: abrirla y fijar WAL en cada llamada
+        # costaba más que la propia escritura del índice
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield con
+        except BaseException:
+            # La conexión sigue viva: no puede quedarse con una transacción a medias
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+
+    # ===== Escritura =====
+    def _guardar_fichero(self, con, contenido, creado):
+        huella = hashlib.sha256(contenido).hexdigest()
+        fila = con.execute("SELECT ruta FROM ficheros WHERE hash = ?", (huella,)).fetchone()
+        if fila and os.path.exists(os.path.join(self.directorio, fila[0])):
+            return huella
+        relativa = os.path.join(time.strftime("%Y/%m/%d", time.localtime(creado)), f"{huella}.xlsx")
+        ruta = os.path.join(self.directorio, relativa)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Escritura atómica: otro worker nunca ve un fichero a medias
+        fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+        con.execute("INSERT OR REPLACE INTO ficheros (hash, ruta, bytes) VALUES (?, ?, ?)",
+                    (huella, relativa, len(contenido)))
+        return huella
+
+    def archivar(self, id_alta, datos, cliente, plantas, correo=None):
+        # Idempotente: un alta ya archivada (mismo id) no se vuelve a escribir.
+        # Devuelve True si el alta es nueva en el archivo.
+        ahora = time.time()
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            if con.execute("SELECT 1 FROM altas WHERE id = ?", (id_alta,)).fetchone():
+                con.execute("ROLLBACK")
+                return False
+            hash_cliente = self._guardar_fichero(con, cliente, ahora)
+            hash_plantas = self._guardar_fichero(con, plantas, ahora)
+            nombre = datos.get("nombre") or "cliente"
+            con.execute(
+                "INSERT INTO altas (id, nif, nombre, nombre_busqueda, correo, creado, estado, actualizado,"
+                " hash_cliente, hash_plantas) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id_alta, normalizar_nif(datos.get("nif")), nombre, _texto_busqueda(nombre), correo,
+                 ahora, PENDIENTE, ahora, hash_cliente, hash_plantas),
+            )
+            con.execute("COMMIT")
+        return True
+
+    def marcar(self, id_alta, ok, detalle=None):
+        with self._conectar() as con:
+            con.execute(
+                "UPDATE altas SET estado = ?, detalle = ?, actualizado = ? WHERE id = ?",
+                (ENVIADO if ok else ERROR, (detalle or "")[:500], time.time(), id_alta),
+            )
+
+    # ===== Consulta =====
+    def _fila(self, fila):
+        claves = ("id", "nif", "nombre", "correo", "creado", "estado", "detalle", "actualizado",
+                  "hash_cliente", "hash_plantas")
+        return dict(zip(claves, fila))
+
+    def buscar(self, nif=None, nombre=None, desde=None, hasta=None, limite=50):
+        condiciones, parametros = [], []
+        if nif:
+            condiciones.append("nif = ?")
+            parametros.append(normalizar_nif(nif))
+        if nombre:
+            condiciones.append("instr(nombre_busqueda, ?) > 0")
+            parametros.append(_texto_busqueda(nombre))
+        if desde is not None:
+            condiciones.append("creado >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("creado < ?")
+            parametros.append(hasta)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._conectar() as con:
+            filas = con.execute(
+                "SELECT id, nif, nombre, correo, creado, estado, detalle, actualizado, hash_cliente, hash_plantas"
+                f" FROM altas {donde} ORDER BY creado DESC LIMIT ?",
+                (*parametros, limite),
+            ).fetchall()
+        return [self._fila(f) for f in filas]
+
+    def obtener(self, id_alta):
+        with self._conectar() as con:
+            fila = con.execute(
+                "SELECT id, nif, nombre, correo, creado, estado, detalle, actualizado, hash_cliente, hash_plantas"
+                " FROM altas WHERE id = ?", (id_alta,)
+            ).fetchone()
+        return self._fila(fila) if fila else None
+
+    def ruta_fichero(self, huella):
+        with self._conectar() as con:
+            fila = con.execute("SELECT ruta FROM ficheros WHERE hash = ?", (huella,)).fetchone()
+        return os.path.join(self.directorio, fila[0]) if fila else None
+
+    def leer_fichero(self, huella):
+        # Se comprueba el hash: un fichero alterado en disco no se reenvía
+        ruta = self.ruta_fichero(huella)
+        if ruta is None or not os.path.exists(ruta):
+            return None
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+        return contenido if hashlib.sha256(contenido).hexdigest() == huella else None
+
+    def estadisticas(self):
+        with self._conectar() as con:
+            por_estado = dict(con.execute("SELECT estado, COUNT(*) FROM altas GROUP BY estado").fetchall())
+            ficheros, tamano = con.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM ficheros").fetchone()
+        return {"altas": por_estado, "ficheros": ficheros, "bytes": tamano, "directorio": self.directorio}
@@ -0,0 +1,346 @@
+# Benchmarks del pipeline de /guardar: micro-benchmarks de cada pieza (Excel de
+# cliente y de plantas, codificación de adjuntos, cuerpo del correo) y una prueba
+# de carga de extremo a extremo con el test client de Flask contra el stub local
+# del webhook. Los resultados se guardan en JSON para comparar ejecuciones.
+#
+#   python benchmark.py                               # todo, motores openpyxl y xml
+#   python benchmark.py --solo micro --repeticiones 50
+#   python benchmark.py --solo carga --altas 500 --concurrencia 4
+#   python benchmark.py --solo carga --flujos borrador
+#   python benchmark.py --comparar bench_resultados/anterior.json
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+import stub_webhook
+
+DIRECTORIO_RESULTADOS = "bench_resultados"
+
+CAMPOS_CLIENTE = (
+    "nombre", "nif", "telefono_general", "email_general", "web", "direccion", "cp", "poblacion",
+    "provincia", "forma_pago", "compras_nombre", "compras_telefono", "compras_email",
+    "contabilidad_nombre", "contabilidad_telefono", "contabilidad_email", "facturacion_nombre",
+    "facturacion_telefono", "facturacion_email", "descarga_nombre", "descarga_telefono",
+    "descarga_email", "contacto_documentacion", "contacto_devoluciones", "sepa_nombre_banco",
+    "sepa_domicilio_banco", "sepa_cp", "sepa_poblacion", "sepa_provincia", "iban_completo",
+)
+CAMPOS_PLANTA = (
+    "nombre", "direccion", "cp", "poblacion", "provincia", "telefono", "email", "horario",
+    "observaciones", "contacto_nombre", "contacto_telefono", "contacto_email",
+)
+
+
+# ===== Datos de prueba =====
+def datos_formulario(plantas=1, n=0):
+    # n da a cada alta de la prueba de carga datos distintos (nombre, NIF...)
+    datos = {campo: f"{campo} {n} ñ&<>" for campo in CAMPOS_CLIENTE}
+    datos["nif"] = f"B{n:08d}"
+    datos["correo_comercial"] = "comercial@example.com"
+    for i in range(1, plantas + 1):
+        for campo in CAMPOS_PLANTA:
+            datos[f"planta_{campo}_{i}"] = f"{campo} {i}"
+    return datos
+
+
+def firma_data_url():
+    # Trazo a mano alzada sobre un canvas como el del formulario (600x200)
+    img = Image.new("RGBA", (600, 200), (255, 255, 255, 0))
+    dibujo = ImageDraw.Draw(img)
+    puntos = [(20 + x * 8, 100 + int(60 * ((x * 7) % 13 - 6) / 6)) for x in range(70)]
+    dibujo.line(puntos, fill=(0, 0, 0, 255), width=3)
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+# ===== Estadística =====
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    i = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[i]
+
+
+def resumir(tiempos):
+    ordenados = sorted(tiempos)
+    total = sum(ordenados)
+    return {
+        "n": len(ordenados),
+        "min_ms": round(ordenados[0] * 1000, 3),
+        "media_ms": round(total / len(ordenados) * 1000, 3),
+        "p50_ms": round(_percentil(ordenados, 50) * 1000, 3),
+        "p95_ms": round(_percentil(ordenados, 95) * 1000, 3),
+        "p99_ms": round(_percentil(ordenados, 99) * 1000, 3),
+        "max_ms": round(ordenados[-1] * 1000, 3),
+        "ops_s": round(len(ordenados) / total, 2) if total else None,
+    }
+
+
+def medir(funcion, repeticiones, calentamiento=3):
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+    return resumir(tiempos)
+
+
+def rss_mb():
+    # RSS actual (Linux); en otros sistemas, el pico que da getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1_048_576
+    except OSError:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / (1_048_576 if sys.platform == "darwin" else 1024)
+
+
+# ===== Micro-benchmarks =====
+def micro_benchmarks(app, motores, repeticiones):
+    import excel_altas
+    from firma import procesar_firma
+
+    data_url = firma_data_url()
+    firma = procesar_firma(data_url, excel_altas.FIRMA_ANCHO, excel_altas.FIRMA_ALTO)
+    datos_1 = datos_formulario(plantas=1)
+    datos_10 = datos_formulario(plantas=10)
+    resultados = {}
+
+    def registrar(nombre, funcion):
+        resultados[nombre] = medir(funcion, repeticiones)
+        print(f"  {nombre:<45} p50={resultados[nombre]['p50_ms']:>9.3f} ms  "
+              f"p95={resultados[nombre]['p95_ms']:>9.3f} ms  {resultados[nombre]['ops_s']:>9} ops/s")
+
+    for motor in motores:
+        excel_altas.EXCEL_MOTOR = motor
+        excel_altas.precargar()
+        print(f"Motor {motor}:")
+        registrar(f"{motor}/crear_excel_en_memoria", lambda: app.crear_excel_en_memoria(datos_1))
+        registrar(f"{motor}/crear_excel_en_memoria+firma", lambda: app.crear_excel_en_memoria(datos_1, firma))
+        for plantas, datos in ((1, datos_1), (10, datos_10)):
+            registrar(f"{motor}/crear_excel_plantas_en_memoria[{plantas}]",
+                      lambda datos=datos: app.crear_excel_plantas_en_memoria(datos))
+
+    # Adjuntos de tamaño real (los del último motor medido)
+    cliente = app.crear_excel_en_memoria(datos_10, firma)
+    plantas = app.crear_excel_plantas_en_memoria(datos_10)
+    print("Envío:")
+    registrar("_encode_attachment", lambda: app._encode_attachment(cliente, "cliente.xlsx"))
+    registrar("payload completo (base64 + JSON)", lambda: b"".join(app._construir_payload(
+        {"to": "a@example.com", "subject": "s", "text": "t", "html": "h"},
+        [app._encode_attachment(cliente, "cliente.xlsx"), app._encode_attachment(plantas, "plantas.xlsx")],
+    )))
+    registrar("construir_body_html", lambda: app.construir_body_html("Cliente <Ñ> & Hijos"))
+    registrar("procesar_firma", lambda: procesar_firma(data_url, excel_altas.FIRMA_ANCHO, excel_altas.FIRMA_ALTO))
+    return resultados
+
+
+# ===== Prueba de carga =====
+RE_BORRADOR = re.compile(r'name="borrador" value="([^"]+)"')
+RE_ID_ENVIO = re.compile(r'name="id_envio" value="([0-9a-f]{32})"')
+
+
+def _alta_directa(cliente, datos):
+    # Todo en un POST /guardar (BORRADORES=false o una página antigua)
+    r = cliente.post("/guardar", data=datos)
+    return [r.status_code]
+
+
+def _alta_con_borrador(cliente, datos):
+    # Los dos pasos del navegador: POST /plantas con el cliente y la firma (crea el
+    # borrador y la cookie), GET /plantas tras la redirección y POST /guardar con las
+    # plantas, el token del borrador y el id_envio de la página
+    paso1 = {k: v for k, v in datos.items() if not k.startswith("planta_")}
+    paso2 = {k: v for k, v in datos.items() if k.startswith("planta_")}
+    codigos = [cliente.post("/plantas", data=paso1).status_code]
+    r = cliente.get("/plantas")
+    codigos.append(r.status_code)
+    pagina = r.get_data(as_text=True)
+    borrador, id_envio = RE_BORRADOR.search(pagina), RE_ID_ENVIO.search(pagina)
+    if borrador is None or id_envio is None:
+        return codigos + [None]
+    paso2["borrador"], paso2["id_envio"] = borrador.group(1), id_envio.group(1)
+    codigos.append(cliente.post("/guardar", data=paso2).status_code)
+    return codigos
+
+
+FLUJOS = {"directo": _alta_directa, "borrador": _alta_con_borrador}
+
+
+def prueba_carga(app, servidor, altas, concurrencia, plantas, sincrono, flujo="directo", espera_cola=120.0):
+    # Cada alta es un POST /guardar completo (con firma) o, con flujo="borrador", los
+    # pasos /plantas -> /guardar del navegador, y la latencia es la del alta entera;
+    # en modo cola se mide además cuánto tarda la cola en vaciarse
+    app.FORCE_SYNC_SEND = sincrono
+    esperados = [200] if flujo == "directo" else [302, 200, 200]
+    recibidas_antes = len(servidor.recibidas)
+    enviados_antes = app.outbox.estadisticas()["enviados"]
+    data_url = firma_data_url()
+    locales = threading.local()
+    errores = []
+    base = int(time.time() * 1000) % 10_000_000 * 1000
+
+    def enviar(n):
+        cliente = getattr(locales, "cliente", None)
+        if cliente is None:
+            cliente = locales.cliente = app.app.test_client()
+        datos = datos_formulario(plantas=plantas, n=base + n)
+        datos["firma_cliente"] = data_url
+        t0 = time.perf_counter()
+        codigos = FLUJOS[flujo](cliente, datos)
+        duracion = time.perf_counter() - t0
+        if codigos != esperados:
+            errores.append(codigos)
+        return duracion
+
+    for n in range(3):  # calentamiento fuera de la medida
+        enviar(-1 - n)
+    rss_inicial = rss_mb()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as pool:
+        tiempos = list(pool.map(enviar, range(altas)))
+    segundos = time.perf_counter() - t0
+    rss_final = rss_mb()
+
+    resultado = {
+        "modo": "sincrono" if sincrono else "cola",
+        "flujo": flujo,
+        "altas": altas,
+        "concurrencia": concurrencia,
+        "plantas_por_alta": plantas,
+        "latencia": resumir(tiempos),
+        "altas_por_segundo": round(altas / segundos, 2),
+        "segundos": round(segundos, 3),
+        "errores_http": len(errores),
+        "rss_inicial_mb": round(rss_inicial, 1),
+        "rss_final_mb": round(rss_final, 1),
+        "rss_crecimiento_mb": round(rss_final - rss_inicial, 1),
+    }
+    if not sincrono:
+        objetivo = enviados_antes + altas + 3
+        limite = time.monotonic() + espera_cola
+        while app.outbox.estadisticas()["enviados"] < objetivo and time.monotonic() < limite:
+            time.sleep(0.05)
+        vaciado = time.perf_counter() - t0
+        resultado["segundos_hasta_vaciar_cola"] = round(vaciado, 3)
+        resultado["altas_enviadas_por_segundo"] = round(altas / vaciado, 2)
+        resultado["cola"] = app.outbox.estadisticas()
+    resultado["posts_webhook"] = len(servidor.recibidas) - recibidas_antes
+    return resultado
+
+
+def _imprimir_carga(r):
+    lat = r["latencia"]
+    print(f"  {r['modo']:<9} {r['flujo']:<9} {r['altas']} altas x{r['concurrencia']}: {r['altas_por_segundo']} altas/s  "
+          f"p50={lat['p50_ms']} ms p95={lat['p95_ms']} ms p99={lat['p99_ms']} ms  "
+          f"RSS {r['rss_crecimiento_mb']:+} MB  errores={r['errores_http']}")
+    if "segundos_hasta_vaciar_cola" in r:
+        print(f"                      cola vaciada en {r['segundos_hasta_vaciar_cola']} s "
+              f"({r['altas_enviadas_por_segundo']} altas/s enviadas)")
+
+
+# ===== Comparación =====
+def comparar(actual, anterior):
+    print(f"\nComparación con {anterior['fecha']} ({anterior.get('commit') or 'sin commit'}):")
+    for nombre, r in actual.get("micro", {}).items():
+        previo = anterior.get("micro", {}).get(nombre)
+        if previo:
+            cambio = (r["p50_ms"] - previo["p50_ms"]) / previo["p50_ms"] * 100 if previo["p50_ms"] else 0.0
+            print(f"  {nombre:<45} p50 {previo['p50_ms']:>9.3f} -> {r['p50_ms']:>9.3f} ms ({cambio:+.1f}%)")
+    # Las ejecuciones anteriores al escenario con borrador solo tenían el flujo directo
+    previas = {(c["modo"], c.get("flujo", "directo"), c["concurrencia"]): c for c in anterior.get("carga", [])}
+    for r in actual.get("carga", []):
+        previo = previas.get((r["modo"], r["flujo"], r["concurrencia"]))
+        if previo:
+            print(f"  carga {r['modo']} {r['flujo']} x{r['concurrencia']:<19} "
+                  f"{previo['altas_por_segundo']:>9} -> {r['altas_por_segundo']:>9} altas/s, "
+                  f"p99 {previo['latencia']['p99_ms']} -> {r['latencia']['p99_ms']} ms")
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks y prueba de carga del pipeline de /guardar")
+    parser.add_argument("--solo", choices=["micro", "carga"])
+    parser.add_argument("--motores", default="openpyxl,xml", help="motores Excel a medir (EXCEL_MOTOR)")
+    parser.add_argument("--repeticiones", type=int, default=30)
+    parser.add_argument("--altas", type=int, default=100, help="altas por escenario de carga")
+    parser.add_argument("--concurrencia", default="1,4", help="hilos concurrentes por escenario de carga")
+    parser.add_argument("--plantas", type=int, default=3, help="plantas por alta en la prueba de carga")
+    parser.add_argument("--flujos", default="directo,borrador",
+                        help="flujos de la prueba de carga: directo (POST /guardar) y borrador (/plantas -> /guardar)")
+    parser.add_argument("--modo-webhook", choices=["ok", "lento"], default="ok")
+    parser.add_argument("--retardo-webhook", type=float, default=0.2, help="segundos del stub en modo lento")
+    parser.add_argument("--salida", help=f"fichero JSON (por defecto {DIRECTORIO_RESULTADOS}/<fecha>.json)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    args = parser.parse_args()
+    motores = [m.strip() for m in args.motores.split(",") if m.strip()]
+
+    # El stub, la cola, los borradores y el archivo (temporales) se configuran antes de importar app
+    servidor, url = stub_webhook.arrancar(modo=args.modo_webhook, retardo=args.retardo_webhook)
+    temporal = tempfile.mkdtemp(prefix="bench_formulario_")
+    os.environ["GAS_WEBHOOK_URL"] = url
+    os.environ["OUTBOX_DB"] = os.path.join(temporal, "outbox.sqlite3")
+    os.environ["BORRADORES_DB"] = os.path.join(temporal, "borradores.sqlite3")
+    os.environ["ARCHIVO_DIR"] = os.path.join(temporal, "formularios_guardados")
+    os.environ.setdefault("OUTBOX_BACKOFF_BASE", "0.1")
+    import logging
+    logging.disable(logging.INFO)
+    import app
+
+    resultado = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "motores": motores,
+        "webhook": {"modo": args.modo_webhook, "retardo_s": args.retardo_webhook if args.modo_webhook == "lento" else 0},
+    }
+    if args.solo != "carga":
+        print(f"Micro-benchmarks ({args.repeticiones} repeticiones):")
+        resultado["micro"] = micro_benchmarks(app, motores, args.repeticiones)
+    if args.solo != "micro":
+        import excel_altas
+        excel_altas.EXCEL_MOTOR = motores[-1]
+        excel_altas.precargar()
+        print(f"\nCarga de extremo a extremo (motor {motores[-1]}):")
+        resultado["carga"] = []
+        flujos = [f.strip() for f in args.flujos.split(",") if f.strip()]
+        for concurrencia in (int(c) for c in args.concurrencia.split(",")):
+            for flujo in flujos:
+                for sincrono in (True, False):
+                    r = prueba_carga(app, servidor, args.altas, concurrencia, args.plantas, sincrono, flujo)
+                    resultado["carga"].append(r)
+                    _imprimir_carga(r)
+
+    salida = args.salida or os.path.join(DIRECTORIO_RESULTADOS, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en {salida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+    app.outbox.detener(5)
@@ -0,0 +1,140 @@
+# Borradores del alta en el servidor (SQLite). El paso 1 (/plantas) guarda los
+# datos del cliente y el navegador solo recibe un token firmado; el paso 2
+# (/guardar) envía únicamente los campos de las plantas. Los borradores caducan
+# a los `ttl` segundos, tienen un tamaño máximo y se descartan los más antiguos
+# si se supera `max_borradores`.
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS borradores (
+    id          TEXT PRIMARY KEY,
+    datos       TEXT NOT NULL,
+    bytes       INTEGER NOT NULL,
+    creado      REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    expira      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS borradores_expira ON borradores (expira);
+"""
+
+
+class BorradorDemasiadoGrande(ValueError):
+    pass
+
+
+class AlmacenBorradores:
+    def __init__(self, ruta_db, secreto, ttl=7200, max_bytes=262_144, max_borradores=10_000):
+        self.ruta_db = ruta_db
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_borradores = max_borradores
+        self._firmante = URLSafeTimedSerializer(secreto, salt="borrador-alta")
+        self._local = threading.local()
+        with self._conectar() as con:
+            con.executescript(_ESQUEMA)
+
+    @contextmanager
+    def _conectar(self):
+        # Una conexión por hilo, reutilizada (como en archivo.py y outbox.py)
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield con
+        except BaseException:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+
+    def _id(self, token):
+        if not token:
+            return None
+        try:
+            return self._firmante.loads(token, max_age=self.ttl)
+        except BadSignature:  # incluye SignatureExpired
+            return None
+
+    def obtener(self, token):
+        id_borrador = self._id(token)
+        if id_borrador is None:
+            return None
+        with self._conectar() as con:
+            fila = con.execute(
+                "SELECT datos FROM borradores WHERE id = ? AND expira > ?", (id_borrador, time.time())
+            ).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def guardar(self, token, datos):
+        # Crea un borrador (token=None) o añade/actualiza campos en uno existente.
+        # Devuelve el token, o None si el token no es válido o el borrador ha caducado.
+        ahora = time.time()
+        if token is None:
+            return self._crear(datos, ahora)
+        id_borrador = self._id(token)
+        if id_borrador is None:
+            return None
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            fila = con.execute(
+                "SELECT datos FROM borradores WHERE id = ? AND expira > ?", (id_borrador, ahora)
+            ).fetchone()
+            if fila is None:
+                con.execute("ROLLBACK")
+                return None
+            contenido = self._serializar({**json.loads(fila[0]), **datos})
+            if contenido is None:
+                con.execute("ROLLBACK")
+                raise BorradorDemasiadoGrande(f"el borrador supera {self.max_bytes} bytes")
+            con.execute(
+                "UPDATE borradores SET datos = ?, bytes = ?, actualizado = ?, expira = ? WHERE id = ?",
+                (contenido, len(contenido), ahora, ahora + self.ttl, id_borrador),
+            )
+            con.execute("COMMIT")
+        return token
+
+    def _crear(self, datos, ahora):
+        contenido = self._serializar(datos)
+        if contenido is None:
+            raise BorradorDemasiadoGrande(f"el borrador supera {self.max_bytes} bytes")
+        id_borrador = secrets.token_urlsafe(16)
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("DELETE FROM borradores WHERE expira <= ?", (ahora,))
+            con.execute(
+                "INSERT INTO borradores (id, datos, bytes, creado, actualizado, expira) VALUES (?, ?, ?, ?, ?, ?)",
+                (id_borrador, contenido, len(contenido), ahora, ahora, ahora + self.ttl),
+            )
+            # Tope de borradores: se descartan los menos recientes
+            con.execute(
+                "DELETE FROM borradores WHERE id IN "
+                "(SELECT id FROM borradores ORDER BY actualizado DESC LIMIT -1 OFFSET ?)",
+                (self.max_borradores,),
+            )
+            con.execute("COMMIT")
+        return self._firmante.dumps(id_borrador)
+
+    def _serializar(self, datos):
+        contenido = json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+        return contenido if len(contenido.encode("utf-8")) <= self.max_bytes else None
+
+    def eliminar(self, token):
+        id_borrador = self._id(token)
+        if id_borrador is None:
+            return
+        with self._conectar() as con:
+            con.execute("DELETE FROM borradores WHERE id = ?", (id_borrador,))
+
+    def estadisticas(self):
+        with self._conectar() as con:
+            total, tamano = con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM borradores WHERE expira > ?", (time.time(),)
+            ).fetchone()
+        return {"borradores": total, "bytes": tamano, "ttl_s": self.ttl, "max_borradores": self.max_borradores}
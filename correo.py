@@ -0,0 +1,196 @@
+# Cuerpo del correo de alta. Las tablas de riesgo, sector y subsectores se
+# generan una vez desde los datos de abajo y el HTML completo queda pre-renderizado
+# con un único hueco para el nombre del cliente, que se escapa al sustituirlo.
+# La versión en texto plano sale de los mismos datos.
+import html
+
+# ===== Datos =====
+RIESGOS = ["0", "500", "1000", "1500", "2000", "2500", "3000", "3500", "4000", "4500", "5000", "20000"]
+RIESGO_OTRO = "Otro (especificar)"
+
+SECTORES = ["Agricultura", "Aguas", "Alimentación", "Distribuidor", "Ganadería", "Industrial", "Piscinas", "Sector0"]
+
+SUBSECTORES = [
+    ("Agricultura", ["(AG)Agricultura"]),
+    ("Aguas", ["(A)Industrial", "(A)Potable", "(A)Residual"]),
+    ("Alimentación", [
+        "(AL)Aceituna", "(AL)Aditivos, aromas, azucares y salsas", "(AL)Bebidas", "(AL)Cárnicas",
+        "(AL)Chocolate, café y confiteria", "(AL)Conserva - procesado frutas, hortalizas y cereales",
+        "(AL)Grasas animales y vegetales", "(AL)Lácteos", "(AL)Panadería,pasta,harina,galletas, y pasteleria",
+        "(AL)Pescado", "(AL)Vino",
+    ]),
+    ("Distribuidor", [
+        "(D)Agricultura", "(D)Aguas", "(D)Alimentación", "(D)Ganadería", "(D)Industrial", "(D)Piscinas",
+    ]),
+    ("Ganadería", ["(G)Explotaciones Ganaderas", "(G)Fabricación Alimentos FEED"]),
+    ("Industrial", [
+        "(I)Biodiésel", "(I)Cemento,yeso y hormigón", "(I)Comercio", "(I)Construcción",
+        "(I)Detergencia y Cosmética", "(I)Energía", "(I)Energía Renovable", "(I)Farmacia",
+        "(I)Fertilizantes y agroquímicos", "(I)Madera", "(I)Metalurgia", "(I)Minerales",
+        "(I)Papel y cartón", "(I)Petróleo y gas", "(I)Pinturas,barnices,resinas,masillas,tintas",
+        "(I)Plástico", "(I)Química básica", "(I)Química fina / formulados", "(I)Residuos",
+        "(I)Textil y curtidos", "(I)Transportes", "(I)Vidrio y Cerámica",
+    ]),
+    ("Piscinas", ["(P)Privada", "(P)Pública"]),
+    ("Sector 0", ["(S)Sector 0"]),
+]
+
+# ===== Generación de las tablas (una vez, al importar) =====
+_TH = '<th style="padding: 5px; border: 1px solid black;">{}</th>'
+_TD = '<td style="padding:5px; border:1px solid black;">{}</td>'
+_CHECKBOX = '<input type="checkbox">'
+_SANGRIA_FILA = " " * 24
+
+
+def _fila_cabecera(*celdas):
+    return _SANGRIA_FILA + "<tr>" + "".join(_TH.format(html.escape(c)) for c in celdas) + "</tr>"
+
+
+def _fila_opcion(texto, control=_CHECKBOX):
+    return _SANGRIA_FILA + "<tr>" + _TD.format(html.escape(texto)) + _TD.format(control) + "</tr>"
+
+
+def _tabla(cabecera, filas):
+    return (
+        "            <td style=\"vertical-align: top;\">\n"
+        "                <table style=\"border-collapse: collapse; border: 1px solid black;\">\n"
+        "                    <thead>\n"
+        f"{cabecera}\n"
+        "                    </thead>\n"
+        "                    <tbody>\n"
+        + "\n".join(filas) + "\n"
+        "                    </tbody>\n"
+        "                </table>\n"
+        "            </td>\n"
+    )
+
+
+def _tablas_seleccion_html():
+    riesgo = _tabla(
+        _fila_cabecera("Riesgo", "Selección"),
+        [_fila_opcion(r) for r in RIESGOS]
+        + [_fila_opcion(RIESGO_OTRO, '<input type="text" placeholder="Escriba aquí el riesgo">')],
+    )
+    sector = _tabla(_fila_cabecera("Sector", "Selección"), [_fila_opcion(s) for s in SECTORES])
+    filas_subsector = []
+    for grupo, opciones in SUBSECTORES:
+        filas_subsector.append(_fila_cabecera(grupo, "Selección"))
+        filas_subsector.extend(_fila_opcion(o) for o in opciones)
+    subsector = _tabla(
+        _SANGRIA_FILA + '<tr><th colspan="2" style="padding: 5px; border: 1px solid black;">Subsectores</th></tr>',
+        filas_subsector,
+    )
+    return (
+        '    <table style="width: 100%; border-collapse: collapse;" cellspacing="15">\n'
+        "        <tr>\n"
+        f"{riesgo}\n{sector}\n{subsector}"
+        "        </tr>\n"
+        "    </table>"
+    )
+
+
+def _tablas_seleccion_texto():
+    lineas = ["RIESGO:"]
+    lineas += [f"  [ ] {r}" for r in RIESGOS]
+    lineas.append(f"  [ ] {RIESGO_OTRO}: ________")
+    lineas += ["", "SECTOR:"]
+    lineas += [f"  [ ] {s}" for s in SECTORES]
+    lineas += ["", "SUBSECTOR:"]
+    for grupo, opciones in SUBSECTORES:
+        lineas.append(f"  {grupo}:")
+        lineas += [f"    [ ] {o}" for o in opciones]
+    return "\n".join(lineas)
+
+
+TABLAS_SELECCION_HTML = _tablas_seleccion_html()
+TABLAS_SELECCION_TEXTO = _tablas_seleccion_texto()
+
+# ===== Plantillas pre-renderizadas =====
+_HUECO = "\x00NOMBRE\x00"
+
+_PLANTILLA_HTML = f"""
+    <html>
+    <body>
+    <p>Buenas,</p>
+    <p>Se ha completado el alta de un nuevo cliente en el sistema: <strong>{_HUECO}</strong>.</p>
+    <p>Adjuntamos en este correo dos archivos Excel:<br>
+    - Uno con los datos generales del cliente.<br>
+    - Otro con la información detallada de sus plantas.</p>
+
+    <p><strong><span style='color:red;'>⚠️ IMPORTANTE: REENVIAR ESTE CORREO A MIGUEL INDICANDO EL RIESGO A SOLICITAR PARA ESTE CLIENTE, SECTOR Y SUBSECTOR.</span></strong></p>
+
+    <p><strong>Seleccione el riesgo, el sector y el subsector marcando la casilla correspondiente:</strong></p>
+
+{TABLAS_SELECCION_HTML}
+
+    <p>Gracias por vuestra colaboración.</p>
+    <p>Un saludo,<br>Departamento de Tesorería</p>
+    </body>
+    </html>
+    """
+_HTML_ANTES, _, _HTML_DESPUES = _PLANTILLA_HTML.partition(_HUECO)
+
+_PLANTILLA_TEXTO = f"""Buenas,
+
+Se ha completado el alta de un nuevo cliente en el sistema: {_HUECO}.
+
+Adjuntamos en este correo dos archivos Excel:
+- Uno con los datos generales del cliente.
+- Otro con la información detallada de sus plantas.
+
+IMPORTANTE: REENVIAR ESTE CORREO A MIGUEL INDICANDO EL RIESGO A SOLICITAR PARA ESTE CLIENTE, SECTOR Y SUBSECTOR.
+
+Seleccione el riesgo, el sector y el subsector marcando la casilla correspondiente:
+
+{TABLAS_SELECCION_TEXTO}
+
+Gracias por vuestra colaboración.
+Un saludo,
+Departamento de Tesorería
+"""
+_TEXTO_ANTES, _, _TEXTO_DESPUES = _PLANTILLA_TEXTO.partition(_HUECO)
+
+
+def construir_body_html(nombre_cliente):
+    return _HTML_ANTES + html.escape(str(nombre_cliente)) + _HTML_DESPUES
+
+
+def construir_body_texto(nombre_cliente):
+    return _TEXTO_ANTES + str(nombre_cliente) + _TEXTO_DESPUES
+
+
+def construir_body_html_lote(nombres_clientes):
+    lista = "".join(f"<li><strong>{html.escape(n)}</strong></li>" for n in nombres_clientes)
+    return f"""
+    <html>
+    <body>
+    <p>Buenas,</p>
+    <p>Se han completado {len(nombres_clientes)} altas de nuevos clientes en el sistema:</p>
+    <ul>{lista}</ul>
+    <p>Adjuntamos en este correo dos archivos Excel por cliente:<br>
+    - Uno con los datos generales del cliente.<br>
+    - Otro con la información detallada de sus plantas.</p>
+
+    <p><strong><span style='color:red;'>⚠️ IMPORTANTE: REENVIAR ESTE CORREO A MIGUEL INDICANDO EL RIESGO A SOLICITAR PARA CADA CLIENTE, SECTOR Y SUBSECTOR.</span></strong></p>
+
+    <p><strong>Seleccione el riesgo, el sector y el subsector marcando la casilla correspondiente:</strong></p>
+
+{TABLAS_SELECCION_HTML}
+
+    <p>Gracias por vuestra colaboración.</p>
+    <p>Un saludo,<br>Departamento de Tesorería</p>
+    </body>
+    </html>
+    """
+
+
+def construir_body_texto_lote(nombres_clientes):
+    lista = "\n".join(f"- {n}" for n in nombres_clientes)
+    return (
+        f"Buenas,\n\nSe han completado {len(nombres_clientes)} altas de nuevos clientes en el sistema:\n{lista}\n\n"
+        "Adjuntamos en este correo dos archivos Excel por cliente (datos generales y plantas).\n\n"
+        "IMPORTANTE: REENVIAR ESTE CORREO A MIGUEL INDICANDO EL RIESGO A SOLICITAR PARA CADA CLIENTE, "
+        "SECTOR Y SUBSECTOR.\n\n"
+        f"{TABLAS_SELECCION_TEXTO}\n\n"
+        "Gracias por vuestra colaboración.\nUn saludo,\nDepartamento de Tesorería\n"
+    )
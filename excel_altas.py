@@ -0,0 +1,109 @@
+# Generación de los dos Excel de un alta (ficha de cliente y plantas) a partir de
+# los datos del formulario. Vive aparte de app.py para que los procesos de la
+# importación masiva puedan usarlo sin arrancar Flask ni la cola de envíos.
+import io
+import os
+import logging
+import zipfile
+
+from openpyxl.drawing.image import Image as ExcelImage
+from openpyxl.writer.excel import ExcelWriter
+
+from plantillas import CachePlantillas
+from xlsx_rapido import PlantillaXml, CeldaNoEncontrada, ZipDeterminista
+from mapeo_celdas import valores_cliente, valores_plantas
+from metricas import medir_etapa, tamano_excel
+
+EXCEL_MOTOR = os.getenv("EXCEL_MOTOR", "openpyxl").lower()  # "openpyxl" o "xml" (parcheo directo)
+
+PLANTILLA_CLIENTE = "Copia de Alta de Cliente.xlsx"
+PLANTILLA_PLANTAS = "Copia de Alta de Plantas.xlsx"
+HOJA_CLIENTE = "FICHA CLIENTE"
+HOJA_PLANTAS = "Plantas"
+ANCLA_FIRMA = "B49"
+FIRMA_ANCHO, FIRMA_ALTO = 200, 60
+
+
+def _cargar_plantilla_xml(ruta):
+    if ruta == PLANTILLA_CLIENTE:
+        return PlantillaXml(ruta, HOJA_CLIENTE, ancla_imagen=ANCLA_FIRMA, tamano_imagen=(FIRMA_ANCHO, FIRMA_ALTO))
+    return PlantillaXml(ruta, HOJA_PLANTAS)
+
+
+# Plantillas parseadas una vez por proceso; cada petición recibe una copia propia
+cache_plantillas = CachePlantillas()
+# El índice XML es inmutable: se comparte entre peticiones sin copiar
+cache_plantillas_xml = CachePlantillas(cargar=_cargar_plantilla_xml, copiar=lambda p: p)
+
+
+def precargar():
+    if EXCEL_MOTOR == "xml":
+        cache_plantillas_xml.precargar(PLANTILLA_CLIENTE, PLANTILLA_PLANTAS)
+    else:
+        cache_plantillas.precargar(PLANTILLA_CLIENTE, PLANTILLA_PLANTAS)
+
+
+def _renderizar_xml(plantilla, valores, tipo, imagen=None):
+    # Motor rápido; si la plantilla no tiene alguna celda mapeada volvemos a openpyxl
+    try:
+        with medir_etapa(f"excel_{tipo}.renderizado"):
+            return cache_plantillas_xml.obtener(plantilla).renderizar(valores, imagen)
+    except CeldaNoEncontrada as e:
+        logging.warning("⚠️ Celda %s no está en %s; se usa openpyxl", e, plantilla)
+        return None
+
+
+def _guardar(wb, tipo):
+    # Como wb.save() pero sin la hora actual (en docProps/core.xml y en el zip): el
+    # mismo alta genera siempre los mismos bytes. "modified" queda con la fecha de la plantilla
+    with medir_etapa(f"excel_{tipo}.guardado"):
+        bio = io.BytesIO()
+        wb.properties.modified = wb.properties.created
+        ExcelWriter(wb, ZipDeterminista(bio, "w", zipfile.ZIP_DEFLATED, allowZip64=True)).save()
+        bio.seek(0)
+    return bio
+
+
+def crear_excel_en_memoria(data, firma_bytes=None):
+    # firma_bytes: PNG ya normalizado por procesar_firma
+    valores = valores_cliente(data)
+    bio = None
+    if EXCEL_MOTOR == "xml":
+        bio = _renderizar_xml(PLANTILLA_CLIENTE, valores, "cliente", firma_bytes)
+
+    if bio is None:
+        with medir_etapa("excel_cliente.plantilla"):
+            wb = cache_plantillas.obtener(PLANTILLA_CLIENTE)
+        with medir_etapa("excel_cliente.celdas"):
+            ws = wb[HOJA_CLIENTE]
+            for (fila, col), valor in valores.items():
+                ws.cell(row=fila, column=col, value=valor)
+
+            if firma_bytes:
+                img = ExcelImage(io.BytesIO(firma_bytes))
+                img.width = FIRMA_ANCHO
+                img.height = FIRMA_ALTO
+                ws.add_image(img, ANCLA_FIRMA)
+        bio = _guardar(wb, "cliente")
+
+    tamano_excel.observar(len(bio.getbuffer()), "cliente")
+    return bio
+
+
+def crear_excel_plantas_en_memoria(data):
+    valores = valores_plantas(data)
+    bio = None
+    if EXCEL_MOTOR == "xml":
+        bio = _renderizar_xml(PLANTILLA_PLANTAS, valores, "plantas")
+
+    if bio is None:
+        with medir_etapa("excel_plantas.plantilla"):
+            wb = cache_plantillas.obtener(PLANTILLA_PLANTAS)
+        with medir_etapa("excel_plantas.celdas"):
+            ws = wb[HOJA_PLANTAS]
+            for (fila, col), valor in valores.items():
+                ws.cell(row=fila, column=col, value=valor)
+        bio = _guardar(wb, "plantas")
+
+    tamano_excel.observar(len(bio.getbuffer()), "plantas")
+    return bio
@@ -0,0 +1,67 @@
+# Firma del cliente (canvas -> data URL base64). Se valida y normaliza en memoria
+# antes de generar ningún Excel: sin ficheros temporales, redimensionada al tamaño
+# con que se muestra en la hoja (200x60) y con un tope de bytes, para que el
+# Excel y el payload del webhook sigan siendo pequeños.
+import base64
+import binascii
+import io
+import re
+
+from PIL import Image, UnidentifiedImageError
+
+_RE_DATA_URL = re.compile(r"data:image/(png|jpeg|jpg|webp);base64,", re.I)
+FORMATOS_ADMITIDOS = {"PNG", "JPEG", "WEBP"}
+MAX_PIXELES_ORIGEN = 4000 * 4000
+
+
+class FirmaInvalida(ValueError):
+    pass
+
+
+def _reducir(img, ancho, alto):
+    if img.mode not in ("RGBA", "LA"):
+        img = img.convert("RGBA")
+    return img.resize((ancho, alto), Image.LANCZOS)
+
+
+def _png(img, **opciones):
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True, **opciones)
+    return out.getvalue()
+
+
+def procesar_firma(data_url, ancho=200, alto=60, max_data_url=2_000_000, max_bytes=30_000):
+    # Devuelve los bytes PNG listos para incrustar, o None si no hay firma
+    if not data_url:
+        return None
+    if len(data_url) > max_data_url:
+        raise FirmaInvalida(f"la firma ocupa {len(data_url)} bytes (máximo {max_data_url})")
+    m = _RE_DATA_URL.match(data_url)
+    if not m:
+        raise FirmaInvalida("formato de firma no reconocido")
+    try:
+        crudo = base64.b64decode(data_url[m.end():], validate=True)
+    except (binascii.Error, ValueError):
+        raise FirmaInvalida("la firma no es base64 válido") from None
+
+    try:
+        with Image.open(io.BytesIO(crudo)) as img:
+            if img.format not in FORMATOS_ADMITIDOS:
+                raise FirmaInvalida(f"formato de imagen no admitido: {img.format}")
+            if img.width * img.height > MAX_PIXELES_ORIGEN:
+                raise FirmaInvalida(f"la firma es demasiado grande ({img.width}x{img.height})")
+            img.load()
+            reducida = _reducir(img, ancho, alto)
+    except FirmaInvalida:
+        raise
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        # PIL también lanza ValueError/SyntaxError con PNG truncados o corruptos
+        raise FirmaInvalida(f"la firma no es una imagen válida ({e})") from None
+
+    png = _png(reducida)
+    if len(png) > max_bytes:
+        # Una firma es casi monocroma: con una paleta de 16 colores basta
+        png = _png(reducida.quantize(colors=16, method=Image.Quantize.FASTOCTREE))
+    if len(png) > max_bytes:
+        raise FirmaInvalida(f"la firma ocupa {len(png)} bytes tras comprimirla (máximo {max_bytes})")
+    return png
@@ -0,0 +1,281 @@
+# Importación masiva de altas desde un CSV o XLSX: una fila por cliente y una
+# columna por campo del formulario (nombre, nif, ..., planta_nombre_1, ...).
+# Los Excel se generan en un pool de procesos (openpyxl es CPU puro: con hilos
+# el GIL no deja paralelizar) y se escriben en un zip o se entregan a la cola
+# de envíos. Cada fila con errores se informa sin detener el resto.
+#
+#   python importacion.py clientes.xlsx --zip altas.zip
+#   python importacion.py clientes.csv --enviar
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+import excel_altas
+from firma import procesar_firma, FirmaInvalida
+from mapeo_celdas import validar_alta
+
+IMPORTACION_PROCESOS  = int(os.getenv("IMPORTACION_PROCESOS", "0")) or os.cpu_count() or 1
+IMPORTACION_MAX_FILAS = int(os.getenv("IMPORTACION_MAX_FILAS", "5000"))
+IMPORTACION_DIR       = os.getenv("IMPORTACION_DIR", "importaciones")      # estado y zip de /admin/importar
+IMPORTACION_RETENCION = float(os.getenv("IMPORTACION_RETENCION", "86400"))  # segundos que se conservan
+
+_RE_NO_FICHERO = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+# Códigos postales: si la celda era numérica, Excel quita el 0 inicial (08001 -> 8001)
+_RE_COLUMNA_CP = re.compile(r"(sepa_)?cp|planta_cp_\d+")
+
+
+class ImportacionInvalida(ValueError):
+    pass
+
+
+# ===== Lectura =====
+def leer_altas(fichero, nombre=None, max_filas=IMPORTACION_MAX_FILAS):
+    # fichero: ruta o fichero binario abierto; el formato se deduce de la extensión.
+    # Devuelve [(número de fila en la hoja, datos), ...] sin las filas vacías (las
+    # ";;;" que Excel añade al final de un CSV no cuentan como errores)
+    nombre = (nombre or str(fichero)).lower()
+    try:
+        if nombre.endswith((".xlsx", ".xlsm")):
+            df = pd.read_excel(fichero, dtype=str, keep_default_na=False)
+        elif nombre.endswith((".csv", ".txt")):
+            # sep=None: detecta "," o ";" (Excel en español exporta con ";")
+            df = pd.read_csv(fichero, dtype=str, keep_default_na=False, sep=None,
+                             engine="python", encoding="utf-8-sig")
+        else:
+            raise ImportacionInvalida("formato no admitido: se espera .csv o .xlsx")
+    except ImportacionInvalida:
+        raise
+    except Exception as e:
+        raise ImportacionInvalida(f"no se pudo leer el fichero ({e})") from None
+
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df[[c for c in df.columns if c and not c.startswith("Unnamed:")]]
+    if "nombre" not in df.columns:
+        raise ImportacionInvalida("falta la columna 'nombre'")
+    if len(df) > max_filas:
+        raise ImportacionInvalida(f"el fichero tiene {len(df)} filas (máximo {max_filas})")
+
+    filas = []
+    for numero, registro in enumerate(df.to_dict("records"), start=2):  # la 1 es la cabecera
+        datos = {clave: valor.strip() for clave, valor in registro.items() if valor.strip()}
+        if datos:
+            filas.append((numero, datos))
+    return filas
+
+
+def _avisos_fila(numero, datos):
+    return [
+        {"fila": numero, "columna": clave, "valor": valor,
+         "aviso": "código postal de menos de 5 dígitos: ¿la columna no tenía formato de texto?"}
+        for clave, valor in datos.items()
+        if _RE_COLUMNA_CP.fullmatch(clave) and valor.isdigit() and len(valor) < 5
+    ]
+
+
+# ===== Generación (en los procesos del pool) =====
+def _generar_alta(tarea):
+    numero, datos = tarea
+    nombre = datos.get("nombre") or "cliente"
+    errores = validar_alta(datos)
+    if errores:
+        return {"fila": numero, "nombre": nombre, "error": "; ".join(errores)}
+    t0 = time.perf_counter()
+    try:
+        firma = procesar_firma(datos.get("firma_cliente"), excel_altas.FIRMA_ANCHO, excel_altas.FIRMA_ALTO)
+        cliente = excel_altas.crear_excel_en_memoria(datos, firma).getvalue()
+        plantas = excel_altas.crear_excel_plantas_en_memoria(datos).getvalue()
+    except FirmaInvalida as e:
+        return {"fila": numero, "nombre": nombre, "error": f"firma no válida: {e}"}
+    except Exception as e:
+        return {"fila": numero, "nombre": nombre, "error": f"error generando Excels: {e}"}
+    return {
+        "fila": numero,
+        "nombre": nombre,
+        "correo": datos.get("correo_comercial"),
+        "datos": {k: v for k, v in datos.items() if k != "firma_cliente"},
+        "cliente": cliente,
+        "plantas": plantas,
+        "segundos": time.perf_counter() - t0,
+    }
+
+
+def generar_altas(filas, procesos=IMPORTACION_PROCESOS):
+    # filas: las de leer_altas, numeradas como en la hoja de cálculo. Devuelve
+    # (altas generadas, errores por fila, resumen). Los avisos no detienen la fila
+    t0 = time.perf_counter()
+    tareas = list(filas)
+    avisos = [aviso for numero, datos in tareas for aviso in _avisos_fila(numero, datos)]
+    procesos = max(1, min(procesos, len(tareas)))
+    if procesos == 1:
+        excel_altas.precargar()
+        resultados = list(map(_generar_alta, tareas))
+    else:
+        # spawn y no fork: el proceso padre puede tener hilos vivos (cola de envíos)
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(procesos, mp_context=contexto, initializer=excel_altas.precargar) as pool:
+            resultados = list(pool.map(_generar_alta, tareas, chunksize=max(1, len(tareas) // (procesos * 4))))
+
+    generadas = [r for r in resultados if "error" not in r]
+    errores = [r for r in resultados if "error" in r]
+    segundos = time.perf_counter() - t0
+    resumen = {
+        "filas": len(tareas),
+        "generadas": len(generadas),
+        "errores": len(errores),
+        "procesos": procesos,
+        "segundos": round(segundos, 3),
+        "altas_por_segundo": round(len(generadas) / segundos, 2) if segundos else None,
+        "segundos_generacion_media": (
+            round(sum(a["segundos"] for a in generadas) / len(generadas), 4) if generadas else None
+        ),
+        "avisos": avisos,
+    }
+    return generadas, errores, resumen
+
+
+# ===== Salida =====
+def nombre_fichero(nombre):
+    return _RE_NO_FICHERO.sub("_", nombre).strip(" .")[:80] or "cliente"
+
+
+def escribir_zip(generadas, errores, resumen, destino):
+    # Los .xlsx ya van comprimidos: se guardan tal cual (ZIP_STORED)
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as zf:
+        for alta in generadas:
+            nombre = nombre_fichero(alta["nombre"])
+            carpeta = f"{alta['fila']:05d} - {nombre}"
+            zf.writestr(f"{carpeta}/Copia Alta de Cliente - {nombre}.xlsx", alta["cliente"])
+            zf.writestr(f"{carpeta}/Copia Alta de Plantas - {nombre}.xlsx", alta["plantas"])
+        informe = {"resumen": resumen, "errores": errores}
+        zf.writestr("informe.json", json.dumps(informe, ensure_ascii=False, indent=2))
+
+
+# ===== Importaciones en segundo plano (POST /admin/importar) =====
+_RE_ID_IMPORTACION = re.compile(r"[0-9a-f]{32}")
+
+
+class ImportacionesEnSegundoPlano:
+    # Miles de filas no caben en el timeout de gunicorn: la petición solo lee el
+    # fichero y la generación corre en un hilo, una importación a la vez por proceso
+    # (el pool ya ocupa todas las CPU). El estado y el zip se guardan en disco
+    # (<id>.json, <id>.zip) para que los sirva cualquier worker de gunicorn.
+    def __init__(self, directorio=IMPORTACION_DIR, procesos=IMPORTACION_PROCESOS, retencion=IMPORTACION_RETENCION):
+        self.directorio = directorio
+        self.procesos = procesos
+        self.retencion = retencion
+        os.makedirs(directorio, exist_ok=True)
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="importacion")
+
+    def _ruta(self, id_importacion, extension):
+        return os.path.join(self.directorio, f"{id_importacion}.{extension}")
+
+    def _escribir_estado(self, id_importacion, estado):
+        # Escritura atómica: una consulta nunca lee un JSON a medias
+        temporal = self._ruta(id_importacion, "json.tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False)
+        os.replace(temporal, self._ruta(id_importacion, "json"))
+
+    def _purgar(self):
+        limite = time.time() - self.retencion
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+    def lanzar(self, filas, nombre, destino, encolar=None):
+        # destino "zip" deja los Excel en <id>.zip; "envio" los entrega a encolar(generadas)
+        self._purgar()
+        id_importacion = uuid.uuid4().hex
+        estado = {"estado": "pendiente", "fichero": nombre, "destino": destino, "filas": len(filas),
+                  "creado": time.time()}
+        self._escribir_estado(id_importacion, estado)
+        self._ejecutor.submit(self._ejecutar, id_importacion, estado, filas, destino, encolar)
+        return id_importacion
+
+    def _ejecutar(self, id_importacion, estado, filas, destino, encolar):
+        self._escribir_estado(id_importacion, {**estado, "estado": "en_curso"})
+        try:
+            generadas, errores, resumen = generar_altas(filas, self.procesos)
+            resultado = {"resumen": resumen, "errores": errores}
+            if destino == "envio":
+                resultado["altas"] = encolar(generadas)
+            else:
+                temporal = self._ruta(id_importacion, "zip.tmp")
+                escribir_zip(generadas, errores, resumen, temporal)
+                os.replace(temporal, self._ruta(id_importacion, "zip"))
+            logging.info("📥 Importación %s (%s): %s", id_importacion, estado["fichero"], resumen)
+            self._escribir_estado(id_importacion, {**estado, "estado": "terminada", **resultado})
+        except Exception as e:
+            logging.exception("❌ Error en la importación %s", id_importacion)
+            self._escribir_estado(id_importacion, {**estado, "estado": "error", "detalle": str(e)})
+
+    def estado(self, id_importacion):
+        if not _RE_ID_IMPORTACION.fullmatch(id_importacion):
+            return None
+        try:
+            with open(self._ruta(id_importacion, "json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def ruta_zip(self, id_importacion):
+        if not _RE_ID_IMPORTACION.fullmatch(id_importacion):
+            return None
+        ruta = self._ruta(id_importacion, "zip")
+        return ruta if os.path.exists(ruta) else None
+
+
+def _imprimir_informe(errores, resumen):
+    for error in errores:
+        print(f"  fila {error['fila']} ({error['nombre']}): {error['error']}", file=sys.stderr)
+    for aviso in resumen["avisos"]:
+        print(f"  aviso fila {aviso['fila']}, {aviso['columna']}={aviso['valor']!r}: {aviso['aviso']}", file=sys.stderr)
+    print(
+        f"{resumen['generadas']}/{resumen['filas']} altas generadas en {resumen['segundos']} s "
+        f"({resumen['altas_por_segundo']} altas/s, {resumen['procesos']} procesos); "
+        f"{resumen['errores']} filas con errores"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importación masiva de altas desde CSV/XLSX")
+    parser.add_argument("fichero")
+    salida = parser.add_mutually_exclusive_group(required=True)
+    salida.add_argument("--zip", help="escribe los Excel de cada alta en este zip")
+    salida.add_argument("--enviar", action="store_true", help="encola el envío de cada alta (como /guardar)")
+    parser.add_argument("--procesos", type=int, default=IMPORTACION_PROCESOS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    try:
+        filas = leer_altas(args.fichero)
+    except ImportacionInvalida as e:
+        sys.exit(f"❌ {e}")
+    generadas, errores, resumen = generar_altas(filas, args.procesos)
+    _imprimir_informe(errores, resumen)
+
+    if args.zip:
+        escribir_zip(generadas, errores, resumen, args.zip)
+        print(f"Zip escrito en {args.zip}")
+    else:
+        # Se importa después de generar: la cola arranca sus hilos al importar app
+        import app
+        if not app.GAS_WEBHOOK_URL:
+            sys.exit("❌ Falta GAS_WEBHOOK_URL")
+        encoladas = app.encolar_importacion(generadas)
+        print(f"{sum(1 for a in encoladas if a['nueva'])} altas encoladas en {app.OUTBOX_DB} "
+              "(las que no se envíen antes de salir las enviará la aplicación)")
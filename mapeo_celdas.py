@@ -0,0 +1,123 @@
+# Mapeo declarativo de los campos del formulario a las celdas de las plantillas.
+# Al importar se compila en un plan de escritura plano de tuplas
+# (fila, columna, clave_formulario) para no construir coordenadas por petición.
+import os
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+# ===== Especificación =====
+# Hoja "FICHA CLIENTE": celda -> campo del formulario
+MAPEO_CLIENTE = [
+    ("B4", "nombre"),
+    ("B5", "nif"),
+    ("D5", "telefono_general"),
+    ("B6", "email_general"),
+    ("D6", "web"),
+    ("B7", "direccion"),
+    ("D7", "cp"),
+    ("B8", "poblacion"),
+    ("D8", "provincia"),
+    ("B13", "forma_pago"),
+    ("B18", "compras_nombre"),
+    ("D18", "compras_telefono"),
+    ("B19", "compras_email"),
+    ("B22", "contabilidad_nombre"),
+    ("D22", "contabilidad_telefono"),
+    ("B24", "contabilidad_email"),
+    ("B27", "facturacion_nombre"),
+    ("D27", "facturacion_telefono"),
+    ("B29", "facturacion_email"),
+    ("B32", "descarga_nombre"),
+    ("D32", "descarga_telefono"),
+    ("B34", "descarga_email"),
+    ("C38", "contacto_documentacion"),
+    ("C39", "contacto_devoluciones"),
+    ("B43", "sepa_nombre_banco"),
+    ("B44", "sepa_domicilio_banco"),
+    ("B45", "sepa_cp"),
+    ("B46", "sepa_poblacion"),
+    ("B47", "sepa_provincia"),
+    ("B48", "iban_completo"),
+]
+
+# Hoja "Plantas": una fila por planta a partir de FILA_PRIMERA_PLANTA.
+# La primera columna (nombre) decide si la planta está rellena.
+COLUMNAS_PLANTA = [
+    ("B", "planta_nombre_{}"),
+    ("C", "planta_direccion_{}"),
+    ("D", "planta_cp_{}"),
+    ("E", "planta_poblacion_{}"),
+    ("F", "planta_provincia_{}"),
+    ("G", "planta_telefono_{}"),
+    ("H", "planta_email_{}"),
+    ("I", "planta_horario_{}"),
+    ("J", "planta_observaciones_{}"),
+    ("K", "planta_contacto_nombre_{}"),
+    ("L", "planta_contacto_telefono_{}"),
+    ("M", "planta_contacto_email_{}"),
+]
+FILA_PRIMERA_PLANTA = 4
+MAX_PLANTAS = int(os.getenv("MAX_PLANTAS", "10"))
+MAX_LONGITUD_CAMPO = 1000  # la firma (data URL) tiene su propio límite
+
+
+# ===== Compilación =====
+def _fila_columna(coord):
+    col, fila = coordinate_from_string(coord)
+    return fila, column_index_from_string(col)
+
+
+def compilar_plan_cliente(mapeo):
+    return tuple((*_fila_columna(coord), clave) for coord, clave in mapeo)
+
+
+def compilar_plan_plantas(columnas, fila_inicial, max_plantas):
+    indices = [(column_index_from_string(col), campo) for col, campo in columnas]
+    plan = []
+    for i in range(1, max_plantas + 1):
+        fila = fila_inicial + i - 1
+        celdas = tuple((fila, col, campo.format(i)) for col, campo in indices)
+        plan.append((celdas[0][2], celdas))
+    return tuple(plan)
+
+
+PLAN_CLIENTE = compilar_plan_cliente(MAPEO_CLIENTE)
+PLAN_PLANTAS = compilar_plan_plantas(COLUMNAS_PLANTA, FILA_PRIMERA_PLANTA, MAX_PLANTAS)
+CLAVES_NOMBRE_PLANTA = tuple(clave_nombre for clave_nombre, _ in PLAN_PLANTAS)
+
+
+# ===== Ejecución del plan =====
+def valores_cliente(data):
+    return {(fila, col): data.get(clave) for fila, col, clave in PLAN_CLIENTE}
+
+
+def valores_plantas(data):
+    valores = {}
+    for clave_nombre, celdas in PLAN_PLANTAS:
+        if not data.get(clave_nombre):
+            continue
+        for fila, col, clave in celdas:
+            valores[(fila, col)] = data.get(clave, "")
+    return valores
+
+
+def hay_alguna_planta(data):
+    return any(data.get(clave) for clave in CLAVES_NOMBRE_PLANTA)
+
+
+def validar_alta(data):
+    # Datos que no vienen del formulario web (API, importación): lista de errores
+    errores = []
+    for clave, valor in data.items():
+        if not isinstance(valor, str):
+            errores.append(f"{clave}: debe ser texto")
+        elif clave != "firma_cliente" and len(valor) > MAX_LONGITUD_CAMPO:
+            errores.append(f"{clave}: más de {MAX_LONGITUD_CAMPO} caracteres")
+        elif ILLEGAL_CHARACTERS_RE.search(valor):
+            errores.append(f"{clave}: contiene caracteres no permitidos")
+    if not data.get("nombre"):
+        errores.append("nombre: obligatorio")
+    if not hay_alguna_planta(data):
+        errores.append("Debe incluir al menos una planta (planta_nombre_1)")
+    return errores
@@ -0,0 +1,139 @@
+# Métricas en memoria (por proceso): histogramas con buckets fijos, medición de
+# etapas del pipeline, exportación en formato texto de Prometheus y perfilado
+# opcional de peticiones con cProfile.
+import bisect
+import cProfile
+import os
+import re
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_ETAPAS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_BYTES = (16_384, 65_536, 131_072, 262_144, 524_288, 1_048_576, 4_194_304, 16_777_216)
+
+
+class Histograma:
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # etiqueta -> [conteos por bucket (+inf al final), suma, total]
+
+    def observar(self, valor, etiqueta=""):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiqueta)
+            if serie is None:
+                serie = self._series[etiqueta] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def resumen(self):
+        with self._lock:
+            series = {k: ([*v[0]], v[1], v[2]) for k, v in self._series.items()}
+        resultado = {}
+        for etiqueta, (conteos, suma, total) in series.items():
+            acumulado, cubetas = 0, {}
+            for limite, n in zip((*self.buckets, float("inf")), conteos):
+                acumulado += n
+                cubetas["+Inf" if limite == float("inf") else str(limite)] = acumulado
+            resultado[etiqueta] = {"buckets": cubetas, "suma": round(suma, 6), "total": total}
+        return resultado
+
+
+# Duración de cada etapa (plantilla, celdas, guardado, firma, codificación, webhook...)
+duracion_etapas = Histograma(BUCKETS_ETAPAS)
+# Tamaño de los Excel generados, por tipo ("cliente" / "plantas")
+tamano_excel = Histograma(BUCKETS_BYTES)
+
+
+@contextmanager
+def medir_etapa(nombre, etapas=None):
+    # Registra la duración en duracion_etapas y, si se pasa, también en el dict etapas
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - t0
+        duracion_etapas.observar(duracion, nombre)
+        if etapas is not None:
+            etapas[nombre] = duracion
+
+
+# ===== Formato Prometheus =====
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(pares):
+    pares = [(k, v) for k, v in pares if v not in (None, "")]
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def exportar_histograma(nombre, ayuda, histograma, etiqueta="etiqueta"):
+    lineas = [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram"]
+    for valor, serie in sorted(histograma.resumen().items()):
+        for limite, n in serie["buckets"].items():
+            lineas.append(f"{nombre}_bucket{_etiquetas([(etiqueta, valor), ('le', limite)])} {n}")
+        lineas.append(f"{nombre}_sum{_etiquetas([(etiqueta, valor)])} {serie['suma']}")
+        lineas.append(f"{nombre}_count{_etiquetas([(etiqueta, valor)])} {serie['total']}")
+    return lineas
+
+
+def exportar_valores(nombre, tipo, ayuda, valores, etiqueta="etiqueta"):
+    # valores: un número o un dict {valor_etiqueta: número}
+    lineas = [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+    if isinstance(valores, dict):
+        for valor, n in sorted(valores.items()):
+            lineas.append(f"{nombre}{_etiquetas([(etiqueta, valor)])} {n}")
+    else:
+        lineas.append(f"{nombre} {valores}")
+    return lineas
+
+
+# ===== Perfilado =====
+_RE_NO_FICHERO = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class Perfilador:
+    # Perfila con cProfile una fracción (tasa, 0..1) de las peticiones y guarda
+    # cada perfil en directorio/<fecha>_<nombre>_<id>.prof (ver con pstats o snakeviz)
+    def __init__(self, tasa=0.0, directorio="perfiles"):
+        self.tasa = tasa
+        self.directorio = directorio
+        self.guardados = 0
+        self._contador = 0
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        if self.tasa <= 0:
+            return None
+        with self._lock:
+            # Muestreo determinista: 1 de cada round(1/tasa) peticiones
+            self._contador += 1
+            if self._contador % max(1, round(1 / self.tasa)):
+                return None
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            return None  # otro perfil activo en este proceso (Python >= 3.12)
+        return perfil
+
+    def terminar(self, perfil, nombre):
+        perfil.disable()
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            fichero = f"{time.strftime('%Y%m%d-%H%M%S')}_{_RE_NO_FICHERO.sub('_', nombre)}_{uuid.uuid4().hex[:8]}.prof"
+            perfil.dump_stats(os.path.join(self.directorio, fichero))
+        except OSError:
+            logging.exception("No se pudo guardar el perfil de %s", nombre)
+            return
+        with self._lock:
+            self.guardados += 1
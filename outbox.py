@@ -0,0 +1,318 @@
+# Cola de salida persistente (SQLite) para los envíos al webhook.
+# Sustituye al hilo "dispara y olvida" por envío: los trabajos sobreviven a un
+# reinicio del worker, se procesan con un pool acotado de hilos y se reintentan
+# con backoff exponencial + jitter. Varios procesos (workers de gunicorn) pueden
+# compartir el mismo fichero: la reserva de trabajos es atómica en la BD.
+# Los trabajos enviados se quedan sin sus datos (Excel, formulario) y los
+# terminados se borran pasado el periodo de retención.
+import base64
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clave TEXT UNIQUE,
+    datos BLOB NOT NULL,
+    estado TEXT NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento REAL NOT NULL,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    ultimo_error TEXT,
+    lote TEXT,
+    etapas TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_estado_proximo ON outbox (estado, proximo_intento);
+"""
+_SIN_DATOS = b"{}"
+_INTERVALO_PURGA = 3600.0  # segundos entre purgas en cada proceso
+# Columnas añadidas después de la primera versión (se migran al arrancar)
+_COLUMNAS_NUEVAS = {"lote": "TEXT", "etapas": "TEXT"}
+
+
+def _serializar(datos):
+    # JSON con los bytes (adjuntos) en base64
+    return json.dumps({
+        k: {"__b64__": base64.b64encode(v).decode("ascii")} if isinstance(v, (bytes, bytearray)) else v
+        for k, v in datos.items()
+    }).encode("utf-8")
+
+
+def _deserializar(blob):
+    return {
+        k: base64.b64decode(v["__b64__"]) if isinstance(v, dict) and "__b64__" in v else v
+        for k, v in json.loads(blob).items()
+    }
+
+
+class Outbox:
+    def __init__(self, ruta_db, manejador, workers=2, max_intentos=8,
+                 backoff_base=5.0, backoff_max=600.0, lease=300.0, intervalo=1.0,
+                 manejador_lote=None, lote_max=20, lote_ventana=300.0, retencion=7 * 86400.0,
+                 aplazamiento=None):
+        self.ruta_db = ruta_db
+        # manejador(datos) -> (ok, detalle). ok=None: el trabajo no se llegó a intentar
+        # (p. ej. circuito abierto) y vuelve a pendiente sin gastar un intento, dentro
+        # de aplazamiento() segundos (o del backoff si no se indica)
+        self.manejador = manejador
+        self.aplazamiento = aplazamiento
+        # Modo lote: manejador_lote([datos, ...]) -> [(ok, detalle), ...] en el mismo orden
+        self.manejador_lote = manejador_lote
+        self.lote_max = lote_max
+        self.lote_ventana = lote_ventana
+        self.num_workers = workers
+        self.max_intentos = max_intentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease  # un trabajo "en_curso" más viejo que esto se considera huérfano
+        self.intervalo = intervalo
+        self.retencion = retencion  # segundos que se conservan los trabajos enviados o fallidos
+        self._ultima_purga = 0.0
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilos = []
+        self._en_vuelo = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._conectar() as con:
+            con.executescript(_ESQUEMA)
+            columnas = {fila[1] for fila in con.execute("PRAGMA table_info(outbox)")}
+            for columna, tipo in _COLUMNAS_NUEVAS.items():
+                if columna not in columnas:
+                    con.execute(f"ALTER TABLE outbox ADD COLUMN {columna} {tipo}")
+
+    @contextmanager
+    def _conectar(self):
+        # Una conexión por hilo, reutilizada (como en archivo.py): cerrar la última
+        # conexión hace un checkpoint del WAL, que costaba ~50 ms en cada encolar
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield con
+        except BaseException:
+            # La conexión sigue viva: no puede quedarse con una transacción a medias
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+
+    # ===== Productor =====
+    def encolar(self, datos, clave=None):
+        ahora = time.time()
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            fila = con.execute("SELECT id, estado FROM outbox WHERE clave = ?", (clave,)).fetchone() if clave else None
+            if fila and fila[1] != FALLIDO:
+                con.execute("COMMIT")
+                logging.info("↩️ Envío duplicado ignorado (clave=%s, estado=%s)", clave, fila[1])
+                return fila[0], False
+            if fila:
+                # Reenvío explícito de un trabajo que agotó sus intentos
+                con.execute(
+                    "UPDATE outbox SET datos = ?, estado = ?, intentos = 0, proximo_intento = ?, "
+                    "actualizado = ?, ultimo_error = NULL WHERE id = ?",
+                    (_serializar(datos), PENDIENTE, ahora, ahora, fila[0]),
+                )
+                id_trabajo = fila[0]
+            else:
+                cur = con.execute(
+                    "INSERT INTO outbox (clave, datos, estado, proximo_intento, creado, actualizado) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (clave, _serializar(datos), PENDIENTE, ahora, ahora, ahora),
+                )
+                id_trabajo = cur.lastrowid
+            con.execute("COMMIT")
+        self._despertar.set()
+        return id_trabajo, True
+
+    # ===== Consumidores =====
+    def _reservar(self):
+        # Devuelve una lista de (id, datos, intentos). En modo lote solo reserva
+        # cuando hay lote_max trabajos listos o el más antiguo ha superado la ventana.
+        ahora = time.time()
+        limite = self.lote_max if self.manejador_lote else 1
+        id_lote = uuid.uuid4().hex[:12] if self.manejador_lote else None
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            filas = con.execute(
+                "SELECT id, datos, intentos, creado FROM outbox "
+                "WHERE estado IN (?, ?) AND proximo_intento <= ? ORDER BY id LIMIT ?",
+                (PENDIENTE, EN_CURSO, ahora, limite),
+            ).fetchall()
+            if self.manejador_lote and len(filas) < limite:
+                if not filas or min(f[3] for f in filas) > ahora - self.lote_ventana:
+                    filas = []
+            if filas:
+                con.executemany(
+                    "UPDATE outbox SET estado = ?, intentos = intentos + 1, proximo_intento = ?, "
+                    "actualizado = ?, lote = ? WHERE id = ?",
+                    [(EN_CURSO, ahora + self.lease, ahora, id_lote, f[0]) for f in filas],
+                )
+            con.execute("COMMIT")
+        return [(f[0], _deserializar(f[1]), f[2] + 1) for f in filas]
+
+    def _espera_reintento(self, intentos):
+        espera = min(self.backoff_max, self.backoff_base * 2 ** (intentos - 1))
+        return espera / 2 + random.uniform(0, espera / 2)
+
+    def _finalizar(self, trabajos, resultados):
+        # Seguimiento individual: cada alta (también dentro de un lote) guarda su resultado
+        ahora = time.time()
+        filas = []
+        for (id_trabajo, _, intentos), (ok, detalle) in zip(trabajos, resultados):
+            if ok:
+                estado, proximo = ENVIADO, ahora
+                logging.info("✅ Trabajo %s enviado: %s", id_trabajo, detalle)
+            elif ok is None:
+                intentos -= 1  # _reservar ya lo había contado
+                espera = self.aplazamiento() if self.aplazamiento else self._espera_reintento(intentos + 1)
+                estado, proximo = PENDIENTE, ahora + max(self.intervalo, espera)
+                logging.warning("⏸️ Trabajo %s aplazado %.0f s: %s", id_trabajo, proximo - ahora, detalle)
+            else:
+                if intentos >= self.max_intentos:
+                    estado, proximo = FALLIDO, ahora
+                else:
+                    estado, proximo = PENDIENTE, ahora + self._espera_reintento(intentos)
+                logging.error("❌ Trabajo %s intento %s -> %s: %s", id_trabajo, intentos, estado, detalle)
+            # Un trabajo enviado ya no necesita sus datos: los Excel y el formulario (IBAN)
+            # quedan solo en el archivo. Los fallidos los conservan hasta la purga
+            filas.append((estado, proximo, ahora, None if ok else detalle, _SIN_DATOS if ok else None,
+                          intentos, id_trabajo))
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany(
+                "UPDATE outbox SET estado = ?, proximo_intento = ?, actualizado = ?, ultimo_error = ?, "
+                "datos = COALESCE(?, datos), intentos = ? WHERE id = ?",
+                filas,
+            )
+            con.execute("COMMIT")
+
+    def purgar(self):
+        # Borra los trabajos terminados (enviados o fallidos) con más de `retencion` segundos
+        limite = time.time() - self.retencion
+        with self._conectar() as con:
+            cur = con.execute(
+                "DELETE FROM outbox WHERE estado IN (?, ?) AND actualizado < ?", (ENVIADO, FALLIDO, limite)
+            )
+        if cur.rowcount:
+            logging.info("🧹 Outbox: %s trabajos terminados purgados", cur.rowcount)
+        return cur.rowcount
+
+    def _ejecutar(self, trabajos):
+        ids = [t[0] for t in trabajos]
+        try:
+            if self.manejador_lote:
+                resultados = self.manejador_lote([t[1] for t in trabajos])
+            else:
+                resultados = [self.manejador(trabajos[0][1])]
+        except Exception as e:
+            logging.exception("❌ Excepción procesando trabajos %s", ids)
+            resultados = [(False, f"Excepción: {e}")] * len(trabajos)
+        return resultados
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            if time.monotonic() - self._ultima_purga >= _INTERVALO_PURGA:
+                self._ultima_purga = time.monotonic()
+                try:
+                    self.purgar()
+                except sqlite3.Error:
+                    logging.exception("❌ Error purgando la outbox")
+            trabajos = self._reservar()
+            if not trabajos:
+                self._despertar.wait(self.intervalo)
+                self._despertar.clear()
+                continue
+            with self._lock:
+                self._en_vuelo += len(trabajos)
+            try:
+                self._finalizar(trabajos, self._ejecutar(trabajos))
+            finally:
+                with self._lock:
+                    self._en_vuelo -= len(trabajos)
+
+    def iniciar(self):
+        if self._hilos:
+            return
+        self._parar.clear()
+        for i in range(self.num_workers):
+            hilo = threading.Thread(target=self._bucle, name=f"outbox-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self, timeout=30.0):
+        # Deja de reservar trabajos nuevos y espera a que terminen los que están en vuelo.
+        # Lo pendiente queda en la BD y se procesará al arrancar de nuevo.
+        self._parar.set()
+        self._despertar.set()
+        limite = time.monotonic() + timeout
+        for hilo in self._hilos:
+            hilo.join(max(0.0, limite - time.monotonic()))
+        vivos = [h.name for h in self._hilos if h.is_alive()]
+        if vivos:
+            logging.warning("⚠️ Outbox detenido con trabajos en vuelo: %s", vivos)
+        self._hilos = []
+
+    # ===== Seguimiento por trabajo =====
+    def anotar_etapas(self, clave, etapas):
+        # Añade duraciones (segundos) por etapa al trabajo identificado por su clave
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            fila = con.execute("SELECT etapas FROM outbox WHERE clave = ?", (clave,)).fetchone()
+            if fila:
+                actuales = json.loads(fila[0]) if fila[0] else {}
+                actuales.update(etapas)
+                con.execute("UPDATE outbox SET etapas = ? WHERE clave = ?", (json.dumps(actuales), clave))
+            con.execute("COMMIT")
+
+    def consultar(self, clave):
+        with self._conectar() as con:
+            fila = con.execute(
+                "SELECT id, estado, intentos, proximo_intento, creado, actualizado, ultimo_error, lote, etapas "
+                "FROM outbox WHERE clave = ?", (clave,),
+            ).fetchone()
+        if not fila:
+            return None
+        return {
+            "id": fila[0],
+            "estado": fila[1],
+            "intentos": fila[2],
+            "proximo_intento": fila[3] if fila[1] == PENDIENTE else None,
+            "creado": fila[4],
+            "actualizado": fila[5],
+            "error": fila[6],
+            "lote": fila[7],
+            "etapas": json.loads(fila[8]) if fila[8] else {},
+        }
+
+    # ===== Estado =====
+    def estadisticas(self):
+        ahora = time.time()
+        with self._conectar() as con:
+            por_estado = dict(con.execute("SELECT estado, COUNT(*) FROM outbox GROUP BY estado").fetchall())
+            mas_antiguo = con.execute(
+                "SELECT MIN(creado) FROM outbox WHERE estado IN (?, ?)", (PENDIENTE, EN_CURSO)
+            ).fetchone()[0]
+        return {
+            "pendientes": por_estado.get(PENDIENTE, 0),
+            "en_curso": por_estado.get(EN_CURSO, 0),
+            "en_vuelo_este_proceso": self._en_vuelo,
+            "enviados": por_estado.get(ENVIADO, 0),
+            "fallidos": por_estado.get(FALLIDO, 0),
+            "antiguedad_pendiente_s": round(ahora - mas_antiguo, 3) if mas_antiguo else 0.0,
+            "workers": len(self._hilos),
+        }
+
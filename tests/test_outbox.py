@@ -0,0 +1,81 @@
+# Cola de salida: reintentos, aplazamiento sin gastar intentos y retención
+import sqlite3
+import time
+
+import pytest
+
+from outbox import Outbox, PENDIENTE, ENVIADO, FALLIDO
+
+
+@pytest.fixture
+def crear_outbox(tmp_path):
+    colas = []
+
+    def crear(manejador, **opciones):
+        opciones = {"workers": 1, "intervalo": 0.05, "backoff_base": 0.05, "backoff_max": 0.05, **opciones}
+        outbox = Outbox(str(tmp_path / "outbox.sqlite3"), manejador, **opciones)
+        colas.append(outbox)
+        return outbox
+
+    yield crear
+    for outbox in colas:
+        outbox.detener(5)
+
+
+def _esperar(outbox, clave, estados, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        trabajo = outbox.consultar(clave)
+        if trabajo and trabajo["estado"] in estados:
+            return trabajo
+        time.sleep(0.05)
+    raise AssertionError(f"{clave}: {outbox.consultar(clave)}")
+
+
+def test_fallo_agota_los_intentos(crear_outbox):
+    outbox = crear_outbox(lambda datos: (False, "error 500"), max_intentos=3)
+    outbox.encolar({"n": 1}, clave="a")
+    outbox.iniciar()
+    trabajo = _esperar(outbox, "a", {FALLIDO})
+    assert trabajo["intentos"] == 3
+    assert trabajo["error"] == "error 500"
+
+
+def test_circuito_abierto_aplaza_sin_gastar_intentos(crear_outbox):
+    llamadas = []
+
+    def manejador(datos):
+        llamadas.append(time.monotonic())
+        return (None, "Circuito abierto") if len(llamadas) <= 5 else (True, "status=200")
+
+    outbox = crear_outbox(manejador, max_intentos=2, aplazamiento=lambda: 0.1)
+    outbox.encolar({"n": 1}, clave="a")
+    outbox.iniciar()
+    trabajo = _esperar(outbox, "a", {ENVIADO, FALLIDO})
+    assert trabajo["estado"] == ENVIADO
+    assert trabajo["intentos"] == 1
+    assert len(llamadas) == 6
+    assert min(b - a for a, b in zip(llamadas, llamadas[1:])) >= 0.09  # respeta aplazamiento()
+
+
+def test_aplazado_queda_pendiente(crear_outbox):
+    outbox = crear_outbox(lambda datos: (None, "Circuito abierto"), max_intentos=1, aplazamiento=lambda: 60)
+    outbox.encolar({"n": 1}, clave="a")
+    outbox.iniciar()
+    time.sleep(0.5)
+    trabajo = outbox.consultar("a")
+    assert trabajo["estado"] == PENDIENTE
+    assert trabajo["intentos"] == 0
+    assert trabajo["proximo_intento"] > time.time() + 50
+
+
+def test_enviado_sin_datos_y_purga(crear_outbox, tmp_path):
+    outbox = crear_outbox(lambda datos: (True, "ok"), retencion=0.2)
+    outbox.encolar({"excel": b"x" * 1000, "iban": "ES00"}, clave="a")
+    outbox.iniciar()
+    _esperar(outbox, "a", {ENVIADO})
+    con = sqlite3.connect(str(tmp_path / "outbox.sqlite3"))
+    assert con.execute("SELECT datos FROM outbox WHERE clave = 'a'").fetchone()[0] == b"{}"
+    time.sleep(0.3)
+    assert outbox.purgar() == 1
+    assert outbox.consultar("a") is None
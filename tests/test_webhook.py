@@ -0,0 +1,103 @@
+# Circuit breaker del cliente del webhook contra el stub local (stub_webhook.py)
+import time
+
+import pytest
+
+from webhook import ClienteWebhook, CERRADO, ABIERTO, SEMIABIERTO
+
+PAYLOAD = {"to": "tesoreria@dimensasl.com", "subject": "Prueba", "attachments": []}
+UMBRAL = 3
+
+
+def _cliente(url, modo, **opciones):
+    opciones = {"umbral_fallos": UMBRAL, "tiempo_apertura": 60.0, **opciones}
+    return ClienteWebhook(f"{url}?modo={modo}", timeout_conexion=1.0, timeout_lectura=5.0, **opciones)
+
+
+def _abrir(cliente):
+    for _ in range(UMBRAL):
+        ok, _ = cliente.enviar(PAYLOAD)
+        assert not ok
+    assert cliente.circuito.estado == ABIERTO
+
+
+def test_ok_mantiene_el_circuito_cerrado(stub):
+    _, url = stub
+    cliente = _cliente(url, "ok")
+    for _ in range(UMBRAL + 2):
+        ok, detalle = cliente.enviar(PAYLOAD)
+        assert ok, detalle
+    assert cliente.circuito.estado == CERRADO
+    assert cliente.resultados["ok"] == UMBRAL + 2
+
+
+@pytest.mark.parametrize("modo, resultado", [("error", "error_http"), ("ko", "respuesta_ko")])
+def test_se_abre_tras_el_umbral_de_fallos(stub, modo, resultado):
+    _, url = stub
+    cliente = _cliente(url, modo)
+    for _ in range(UMBRAL - 1):
+        assert not cliente.enviar(PAYLOAD)[0]
+        assert cliente.circuito.estado == CERRADO
+    assert not cliente.enviar(PAYLOAD)[0]
+    assert cliente.circuito.estado == ABIERTO
+    assert cliente.circuito.aperturas == 1
+    assert cliente.resultados[resultado] == UMBRAL
+
+
+def test_lento_con_timeout_cuenta_como_fallo(stub):
+    _, url = stub
+    cliente = ClienteWebhook(f"{url}?modo=lento", timeout_conexion=1.0, timeout_lectura=0.2,
+                             umbral_fallos=UMBRAL, tiempo_apertura=60.0)
+    _abrir(cliente)
+    assert cliente.resultados["excepcion"] == UMBRAL
+
+
+def test_abierto_falla_sin_llamar_al_webhook(stub):
+    servidor, url = stub
+    cliente = _cliente(url, "error")
+    _abrir(cliente)
+    recibidas = len(servidor.recibidas)
+
+    t0 = time.perf_counter()
+    ok, detalle = cliente.enviar(PAYLOAD)
+    assert time.perf_counter() - t0 < 0.05
+    assert ok is None  # no se intentó: la cola no gasta un intento
+    assert detalle.startswith("Circuito abierto")
+    assert len(servidor.recibidas) == recibidas
+    assert cliente.resultados["circuito_abierto"] == 1
+
+
+def test_se_cierra_tras_una_prueba_correcta(stub):
+    servidor, url = stub
+    cliente = _cliente(url, "error", tiempo_apertura=0.2)
+    _abrir(cliente)
+    time.sleep(0.25)
+    assert cliente.circuito.estado == SEMIABIERTO
+
+    cliente.url = f"{url}?modo=ok"
+    recibidas = len(servidor.recibidas)
+    ok, detalle = cliente.enviar(PAYLOAD)
+    assert ok, detalle
+    assert len(servidor.recibidas) == recibidas + 1
+    assert cliente.circuito.estado == CERRADO
+    assert cliente.enviar(PAYLOAD)[0]
+
+
+def test_semiabierto_deja_pasar_una_sola_prueba(stub):
+    _, url = stub
+    cliente = _cliente(url, "error", tiempo_apertura=0.2)
+    _abrir(cliente)
+    time.sleep(0.25)
+    assert cliente.circuito.permitir()
+    assert not cliente.circuito.permitir()
+
+
+def test_prueba_fallida_vuelve_a_abrir(stub):
+    _, url = stub
+    cliente = _cliente(url, "error", tiempo_apertura=0.2)
+    _abrir(cliente)
+    time.sleep(0.25)
+    assert not cliente.enviar(PAYLOAD)[0]
+    assert cliente.circuito.estado == ABIERTO
+    assert cliente.circuito.aperturas == 2
+    assert cliente.enviar(PAYLOAD)[1].startswith("Circuito abierto")
@@ -0,0 +1,72 @@
+# Paridad del motor XML (xlsx_rapido.py) con openpyxl: mismas celdas, estilos e imagen
+import pytest
+from openpyxl import load_workbook
+from openpyxl.utils.cell import get_column_letter
+
+import excel_altas
+from firma import procesar_firma
+from mapeo_celdas import MAPEO_CLIENTE, PLAN_PLANTAS, MAX_PLANTAS, COLUMNAS_PLANTA
+
+# Las plantillas tienen validaciones de datos que openpyxl no admite (las descarta al leer)
+pytestmark = pytest.mark.filterwarnings("ignore:Data Validation extension is not supported")
+
+FIRMA_PNG_1X1 = (
+    "data:image/png;base64,"
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+def _datos():
+    # Todos los campos mapeados, con caracteres que hay que escapar en el XML
+    datos = {campo: f"{campo} <&> ñ \"'" for _, campo in MAPEO_CLIENTE}
+    datos["forma_pago"] = "Recibo 30D"  # ya existe en sharedStrings: se reutiliza
+    for i in range(1, MAX_PLANTAS + 1):
+        for _, campo in COLUMNAS_PLANTA:
+            datos[campo.format(i)] = f"{campo.format(i)} <&> ñ"
+    return datos
+
+
+def _generar(motor, datos, firma, monkeypatch):
+    monkeypatch.setattr(excel_altas, "EXCEL_MOTOR", motor)
+    return {
+        excel_altas.HOJA_CLIENTE: load_workbook(excel_altas.crear_excel_en_memoria(datos, firma)),
+        excel_altas.HOJA_PLANTAS: load_workbook(excel_altas.crear_excel_plantas_en_memoria(datos)),
+    }
+
+
+def _anclas(ws):
+    return [(i.anchor._from.row, i.anchor._from.col) for i in ws._images]
+
+
+@pytest.mark.parametrize("con_firma", [False, True], ids=["sin_firma", "con_firma"])
+def test_paridad_xml_openpyxl(con_firma, monkeypatch):
+    datos = _datos()
+    firma = procesar_firma(FIRMA_PNG_1X1) if con_firma else None
+    libros_openpyxl = _generar("openpyxl", datos, firma, monkeypatch)
+    libros_xml = _generar("xml", datos, firma, monkeypatch)
+
+    for hoja in (excel_altas.HOJA_CLIENTE, excel_altas.HOJA_PLANTAS):
+        ws_a, ws_b = libros_openpyxl[hoja][hoja], libros_xml[hoja][hoja]
+        diferencias = [
+            f"{hoja}!{ca.coordinate}: {ca.value!r} != {cb.value!r}"
+            for fila_a, fila_b in zip(ws_a.iter_rows(), ws_b.iter_rows())
+            for ca, cb in zip(fila_a, fila_b)
+            if ca.value != cb.value or ca.style_id != cb.style_id
+        ]
+        assert not diferencias
+        assert _anclas(ws_a) == _anclas(ws_b)
+
+    hoja_cliente = libros_xml[excel_altas.HOJA_CLIENTE][excel_altas.HOJA_CLIENTE]
+    assert _anclas(hoja_cliente) == ([(48, 1)] if con_firma else [])  # B49, base 0
+
+
+def test_todos_los_campos_mapeados_llegan_a_su_celda(monkeypatch):
+    datos = _datos()
+    libros = _generar("xml", datos, None, monkeypatch)
+    ws = libros[excel_altas.HOJA_CLIENTE][excel_altas.HOJA_CLIENTE]
+    for celda, campo in MAPEO_CLIENTE:
+        assert ws[celda].value == datos[campo], celda
+    ws = libros[excel_altas.HOJA_PLANTAS][excel_altas.HOJA_PLANTAS]
+    for _, celdas in PLAN_PLANTAS:
+        for fila, columna, campo in celdas:
+            assert ws[f"{get_column_letter(columna)}{fila}"].value == datos[campo], campo
@@ -0,0 +1,216 @@
+# Cliente HTTP del webhook de Apps Script: sesión compartida con pool de
+# conexiones keep-alive (evita DNS + TCP + TLS en cada envío), timeouts de
+# conexión/lectura separados y un circuit breaker que corta los envíos mientras
+# Apps Script está caído o lento, en lugar de acumular peticiones de 30 s.
+import base64
+import json
+import threading
+import time
+import zlib
+import logging
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import Histograma, BUCKETS_BYTES
+
+_TROZO_B64 = 3 * 16_384  # múltiplo de 3: cada trozo se codifica sin relleno intermedio
+
+Adjunto = namedtuple("Adjunto", "filename mimeType datos")
+
+
+class CuerpoJson:
+    # Cuerpo JSON del webhook generado en streaming: los adjuntos se codifican en
+    # base64 por trozos mientras se escriben en el socket, una sola vez y bajo el
+    # nombre (o nombres) de campo configurado, sin construir el dict completo.
+    # Sin gzip la longitud se conoce de antemano (Content-Length); con gzip se
+    # envía con Transfer-Encoding: chunked.
+    def __init__(self, campos, adjuntos, campos_adjunto=("content",), gzip=False):
+        self.campos = campos
+        self.adjuntos = adjuntos
+        self.campos_adjunto = tuple(campos_adjunto)
+        self.gzip = gzip
+        self.bytes_crudos = sum(len(memoryview(a.datos)) for a in adjuntos)
+        self.bytes_enviados = 0
+        self.segundos_codificacion = 0.0
+
+    def _trozos_json(self, con_base64=True):
+        cabecera = json.dumps(self.campos)[:-1]
+        yield (cabecera + (", " if self.campos else "") + '"attachments": [').encode("ascii")
+        for i, adjunto in enumerate(self.adjuntos):
+            meta = json.dumps({"filename": adjunto.filename, "mimeType": adjunto.mimeType})[:-1]
+            yield ((", " if i else "") + meta).encode("ascii")
+            datos = memoryview(adjunto.datos)
+            for campo in self.campos_adjunto:
+                yield f', "{campo}": "'.encode("ascii")
+                if con_base64:
+                    for inicio in range(0, len(datos), _TROZO_B64):
+                        t0 = time.perf_counter()
+                        trozo = base64.b64encode(datos[inicio:inicio + _TROZO_B64])
+                        self.segundos_codificacion += time.perf_counter() - t0
+                        yield trozo
+                yield b'"'
+            yield b"}"
+        yield b"]}"
+
+    def __iter__(self):
+        if not self.gzip:
+            for trozo in self._trozos_json():
+                self.bytes_enviados += len(trozo)
+                yield trozo
+            return
+        compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> formato gzip
+        for trozo in self._trozos_json():
+            comprimido = compresor.compress(trozo)
+            if comprimido:
+                self.bytes_enviados += len(comprimido)
+                yield comprimido
+        final = compresor.flush()
+        self.bytes_enviados += len(final)
+        yield final
+
+    def __len__(self):
+        # Longitud exacta del JSON sin comprimir, calculada sin codificar los adjuntos
+        total = sum(len(trozo) for trozo in self._trozos_json(con_base64=False))
+        for adjunto in self.adjuntos:
+            n = len(memoryview(adjunto.datos))
+            total += len(self.campos_adjunto) * 4 * ((n + 2) // 3)
+        return total
+
+    def cabeceras(self):
+        cabeceras = {"Content-Type": "application/json"}
+        if self.gzip:
+            cabeceras["Content-Encoding"] = "gzip"
+        return cabeceras
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class CircuitBreaker:
+    def __init__(self, umbral_fallos=5, tiempo_apertura=60.0):
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_apertura = tiempo_apertura
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallos_seguidos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self.aperturas = 0
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado_actual()
+
+    def _estado_actual(self):
+        if self._estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.tiempo_apertura:
+            self._estado = SEMIABIERTO
+            self._prueba_en_curso = False
+        return self._estado
+
+    def permitir(self):
+        with self._lock:
+            estado = self._estado_actual()
+            if estado == CERRADO:
+                return True
+            if estado == SEMIABIERTO and not self._prueba_en_curso:
+                # Una sola petición de prueba decide si se vuelve a cerrar
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            self._estado = CERRADO
+            self._fallos_seguidos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos_seguidos += 1
+            if self._estado == SEMIABIERTO or self._fallos_seguidos >= self.umbral_fallos:
+                if self._estado != ABIERTO:
+                    self.aperturas += 1
+                    logging.warning("⚠️ Circuito del webhook abierto tras %s fallos seguidos", self._fallos_seguidos)
+                self._estado = ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._prueba_en_curso = False
+
+    def segundos_para_reintento(self):
+        with self._lock:
+            if self._estado != ABIERTO:
+                return 0.0
+            return max(0.0, self.tiempo_apertura - (time.monotonic() - self._abierto_desde))
+
+
+class ClienteWebhook:
+    def __init__(self, url, pool=10, timeout_conexion=5.0, timeout_lectura=30.0,
+                 umbral_fallos=5, tiempo_apertura=60.0):
+        self.url = url
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool, pool_block=True, max_retries=0)
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+        self.circuito = CircuitBreaker(umbral_fallos, tiempo_apertura)
+        self.latencias = Histograma()
+        self.bytes_payload = Histograma(BUCKETS_BYTES)
+        self._lock = threading.Lock()
+        self.resultados = {"ok": 0, "error_http": 0, "respuesta_ko": 0, "excepcion": 0, "circuito_abierto": 0}
+
+    def _contar(self, resultado, duracion=None):
+        with self._lock:
+            self.resultados[resultado] += 1
+        if duracion is not None:
+            self.latencias.observar(duracion, resultado)
+
+    def enviar(self, payload):
+        # Devuelve (ok, detalle). ok=None: no se llegó a intentar (circuito abierto);
+        # la cola lo reprograma sin gastar un intento
+        if not self.circuito.permitir():
+            self._contar("circuito_abierto")
+            espera = self.circuito.segundos_para_reintento()
+            return None, f"Circuito abierto: webhook deshabilitado durante {espera:.0f}s"
+
+        # payload: CuerpoJson (streaming) o dict (se serializa entero con json=)
+        t0 = time.perf_counter()
+        try:
+            if isinstance(payload, CuerpoJson):
+                datos = iter(payload) if payload.gzip else payload
+                r = self.sesion.post(self.url, data=datos, headers=payload.cabeceras(), timeout=self.timeout)
+                bytes_payload = payload.bytes_enviados
+            else:
+                r = self.sesion.post(self.url, json=payload, timeout=self.timeout)
+                bytes_payload = len(r.request.body or b"")
+        except Exception as e:
+            self._contar("excepcion", time.perf_counter() - t0)
+            self.circuito.registrar_fallo()
+            logging.exception("Excepción en POST al webhook")
+            return False, f"Excepción: {e}"
+
+        duracion = time.perf_counter() - t0
+        self.bytes_payload.observar(bytes_payload)
+        logging.info("Webhook status=%s body=%s (%.0f ms, payload=%d bytes)",
+                     r.status_code, r.text[:400], duracion * 1000, bytes_payload)
+        if r.status_code == 200 and "OK" in r.text:
+            self._contar("ok", duracion)
+            self.circuito.registrar_exito()
+            return True, f"status={r.status_code}"
+
+        self._contar("error_http" if r.status_code != 200 else "respuesta_ko", duracion)
+        self.circuito.registrar_fallo()
+        return False, f"Webhook error status={r.status_code} body={r.text[:400]}"
+
+    def estadisticas(self):
+        with self._lock:
+            resultados = dict(self.resultados)
+        return {
+            "circuito": self.circuito.estado,
+            "aperturas_circuito": self.circuito.aperturas,
+            "resultados": resultados,
+            "latencia_s": self.latencias.resumen(),
+            "payload_bytes": self.bytes_payload.resumen(),
+        }
@@ -0,0 +1,248 @@
+# Motor rápido de generación de Excel: en lugar de cargar la plantilla con
+# openpyxl y re-serializar el libro completo con wb.save(), indexamos una vez el
+# XML de la hoja y los sharedStrings, y por petición solo parcheamos las celdas
+# mapeadas. El resto de miembros del zip se copian ya comprimidos.
+import io
+import os
+import re
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+REL_DRAWING = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/drawing"
+REL_IMAGE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+CT_DRAWING = "application/vnd.openxmlformats-officedocument.drawing+xml"
+
+EMU_POR_PIXEL = 9525
+
+_RE_CELDA = re.compile(r'<c r="([A-Z]+[0-9]+)"([^>]*?)(/>|>.*?</c>)', re.S)
+_RE_ATRIB_T = re.compile(r'\s+t="[^"]*"')
+# Elementos que en CT_Worksheet van detrás de <drawing>
+_RE_TRAS_DRAWING = re.compile(
+    r"<(legacyDrawing|legacyDrawingHF|drawingHF|picture|oleObjects|controls|"
+    r"webPublishItems|tableParts|extLst)[\s>/]|</worksheet>"
+)
+
+DRAWING_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<xdr:wsDr xmlns:xdr="http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main">'
+    '<xdr:oneCellAnchor><xdr:from><xdr:col>{col}</xdr:col><xdr:colOff>0</xdr:colOff>'
+    '<xdr:row>{row}</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:from>'
+    '<xdr:ext cx="{cx}" cy="{cy}"/>'
+    '<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="1" name="Image 1"/><xdr:cNvPicPr/></xdr:nvPicPr>'
+    '<xdr:blipFill><a:blip xmlns:r="{ns_rel}" r:embed="rId1"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+    '<xdr:spPr><a:prstGeom prst="rect"/></xdr:spPr></xdr:pic><xdr:clientData/></xdr:oneCellAnchor>'
+    '</xdr:wsDr>'
+)
+
+
+# Fecha fija de los miembros del zip: el mismo contenido da siempre los mismos bytes
+# (el archivo de altas guarda cada Excel con el hash de su contenido como nombre)
+FECHA_ZIP = (1980, 1, 1, 0, 0, 0)
+
+
+class CeldaNoEncontrada(KeyError):
+    pass
+
+
+class ZipDeterminista(zipfile.ZipFile):
+    # writestr(nombre, ...) sin la hora actual; también lo usa el guardado con openpyxl
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo_or_arcname = zipfile.ZipInfo(zinfo_or_arcname, date_time=FECHA_ZIP)
+            zinfo_or_arcname.compress_type = self.compression
+            zinfo_or_arcname.external_attr = 0o600 << 16
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+    def write(self, filename, arcname=None, compress_type=None, compresslevel=None):
+        # openpyxl añade cada hoja desde un fichero temporal: sin su fecha de modificación
+        with open(filename, "rb") as f:
+            self.writestr(arcname or os.path.basename(filename), f.read(), compress_type, compresslevel)
+
+
+def _parte_rels(parte):
+    carpeta, nombre = posixpath.split(parte)
+    return posixpath.join(carpeta, "_rels", nombre + ".rels")
+
+
+def _siguiente_nombre(existentes, plantilla):
+    i = 1
+    while plantilla.format(i) in existentes:
+        i += 1
+    return plantilla.format(i)
+
+
+class PlantillaXml:
+    def __init__(self, ruta, hoja, ancla_imagen=None, tamano_imagen=(200, 60)):
+        with zipfile.ZipFile(ruta) as zf:
+            self._miembros = [(info, zf.read(info.filename)) for info in zf.infolist()]
+        contenido = {info.filename: datos for info, datos in self._miembros}
+
+        self.parte_hoja = self._resolver_hoja(contenido, hoja)
+        self.parte_rels_hoja = _parte_rels(self.parte_hoja)
+        xml_hoja = contenido[self.parte_hoja].decode("utf-8")
+
+        # Índice de celdas: (fila, columna) -> (coordenada, inicio, fin, atributos sin t="")
+        self._celdas = {}
+        for m in _RE_CELDA.finditer(xml_hoja):
+            col, fila = coordinate_from_string(m.group(1))
+            self._celdas[(fila, column_index_from_string(col))] = (
+                m.group(1), m.start(), m.end(), _RE_ATRIB_T.sub("", m.group(2))
+            )
+        self._xml_hoja = xml_hoja
+
+        # Índice de sharedStrings: texto -> posición, para reutilizar cadenas existentes
+        self._sst = {}
+        if "xl/sharedStrings.xml" in contenido:
+            raiz = ET.fromstring(contenido["xl/sharedStrings.xml"])
+            for i, si in enumerate(raiz.findall(f"{{{NS_MAIN}}}si")):
+                t = si.find(f"{{{NS_MAIN}}}t")
+                if t is not None and t.text is not None:
+                    self._sst.setdefault(t.text, i)
+
+        # Zip base (sin la hoja) con los miembros ya comprimidos
+        self._base_sin_imagen = self._zip_base(contenido, excluir={self.parte_hoja})
+        self._base_con_imagen = None
+        if ancla_imagen:
+            self._preparar_imagen(contenido, ancla_imagen, tamano_imagen)
+
+    @staticmethod
+    def _resolver_hoja(contenido, hoja):
+        wb = ET.fromstring(contenido["xl/workbook.xml"])
+        rels = ET.fromstring(contenido["xl/_rels/workbook.xml.rels"])
+        destinos = {r.get("Id"): r.get("Target") for r in rels}
+        for sh in wb.iter(f"{{{NS_MAIN}}}sheet"):
+            if sh.get("name") == hoja:
+                destino = destinos[sh.get(f"{{{NS_REL}}}id")]
+                if destino.startswith("/"):
+                    return destino[1:]
+                return posixpath.normpath(posixpath.join("xl", destino))
+        raise KeyError(f"Worksheet {hoja} does not exist.")
+
+    def _zip_base(self, contenido, excluir, sustituir=None, extra=None):
+        sustituir = sustituir or {}
+        bio = io.BytesIO()
+        with ZipDeterminista(bio, "w", zipfile.ZIP_DEFLATED) as zf:
+            for info, _ in self._miembros:
+                nombre = info.filename
+                if nombre in excluir:
+                    continue
+                zf.writestr(nombre, sustituir.get(nombre, contenido[nombre]))
+            for nombre, datos in (extra or {}).items():
+                zf.writestr(nombre, datos)
+        return bio.getvalue()
+
+    def _preparar_imagen(self, contenido, ancla, tamano):
+        nombres = set(contenido)
+        self.parte_drawing = _siguiente_nombre(nombres, "xl/drawings/drawing{}.xml")
+        self.parte_media = _siguiente_nombre(nombres, "xl/media/image{}.png")
+
+        col, fila = coordinate_from_string(ancla)
+        drawing = DRAWING_XML.format(
+            col=column_index_from_string(col) - 1, row=fila - 1,
+            cx=tamano[0] * EMU_POR_PIXEL, cy=tamano[1] * EMU_POR_PIXEL, ns_rel=NS_REL,
+        )
+        drawing_rels = (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{NS_PKG_REL}"><Relationship Id="rId1" Type="{REL_IMAGE}" '
+            f'Target="/{self.parte_media}"/></Relationships>'
+        )
+
+        # Relación hoja -> drawing
+        if self.parte_rels_hoja in contenido:
+            rels = contenido[self.parte_rels_hoja].decode("utf-8")
+        else:
+            rels = (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<Relationships xmlns="{NS_PKG_REL}"></Relationships>'
+            )
+        ids = set(re.findall(r'Id="([^"]+)"', rels))
+        self._rid_drawing = _siguiente_nombre(ids, "rId{}")
+        rels = rels.replace(
+            "</Relationships>",
+            f'<Relationship Id="{self._rid_drawing}" Type="{REL_DRAWING}" '
+            f'Target="/{self.parte_drawing}"/></Relationships>',
+        )
+
+        tipos = contenido["[Content_Types].xml"].decode("utf-8")
+        if 'Extension="png"' not in tipos:
+            tipos = tipos.replace(
+                "<Default ", '<Default Extension="png" ContentType="image/png"/><Default ', 1
+            )
+        tipos = tipos.replace(
+            "</Types>",
+            f'<Override PartName="/{self.parte_drawing}" ContentType="{CT_DRAWING}"/></Types>',
+        )
+
+        m = _RE_TRAS_DRAWING.search(self._xml_hoja)
+        self._pos_drawing = m.start()
+
+        sustituir = {"[Content_Types].xml": tipos.encode("utf-8")}
+        extra = {
+            self.parte_drawing: drawing.encode("utf-8"),
+            _parte_rels(self.parte_drawing): drawing_rels.encode("utf-8"),
+        }
+        if self.parte_rels_hoja in contenido:
+            sustituir[self.parte_rels_hoja] = rels.encode("utf-8")
+        else:
+            extra[self.parte_rels_hoja] = rels.encode("utf-8")
+
+        self._base_con_imagen = self._zip_base(
+            contenido, excluir={self.parte_hoja}, sustituir=sustituir, extra=extra
+        )
+
+    def _xml_celda(self, coord, atributos, valor):
+        if valor is None or valor == "":
+            return f'<c r="{coord}"{atributos}/>'
+        valor = str(valor)
+        if ILLEGAL_CHARACTERS_RE.search(valor):
+            raise IllegalCharacterError(f"{valor} cannot be used in worksheets.")
+        idx = self._sst.get(valor)
+        if idx is not None:
+            return f'<c r="{coord}"{atributos} t="s"><v>{idx}</v></c>'
+        espacio = ' xml:space="preserve"' if valor != valor.strip() else ""
+        return f'<c r="{coord}"{atributos} t="inlineStr"><is><t{espacio}>{escape(valor)}</t></is></c>'
+
+    def renderizar(self, valores, imagen_png=None):
+        if imagen_png is not None and self._base_con_imagen is None:
+            raise ValueError("La plantilla no tiene ancla de imagen configurada")
+
+        parches = []
+        for fila_col, valor in valores.items():
+            try:
+                coord, inicio, fin, atributos = self._celdas[fila_col]
+            except KeyError:
+                raise CeldaNoEncontrada(fila_col) from None
+            parches.append((inicio, fin, self._xml_celda(coord, atributos, valor)))
+        if imagen_png is not None:
+            parches.append((self._pos_drawing, self._pos_drawing, f'<drawing r:id="{self._rid_drawing}"/>'))
+        parches.sort(key=lambda p: p[0])
+
+        trozos = []
+        pos = 0
+        xml = self._xml_hoja
+        for inicio, fin, nuevo in parches:
+            trozos.append(xml[pos:inicio])
+            trozos.append(nuevo)
+            pos = fin
+        trozos.append(xml[pos:])
+
+        base = self._base_con_imagen if imagen_png is not None else self._base_sin_imagen
+        bio = io.BytesIO(base)
+        bio.seek(0, io.SEEK_END)
+        with ZipDeterminista(bio, "a", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(self.parte_hoja, "".join(trozos).encode("utf-8"))
+            if imagen_png is not None:
+                zf.writestr(self.parte_media, imagen_png, compress_type=zipfile.ZIP_STORED)
+        bio.seek(0)
+        return bio